@@ -1,12 +1,45 @@
 import os
-import logging
-from logging.handlers import TimedRotatingFileHandler
+import time
+import threading
 from flask import Flask
 from dotenv import load_dotenv
 
-from models import init_db
+import metrics
+import logsetup
+import profiling
+from authz import authz_index
+from passwords import hash_pool, ip_throttle, user_throttle
+from models import close_request_connection, db_pool, init_db
+from cache import config_cache, config_types
+from decoys import decoy_store
+from watcher import file_watcher
+from feed import change_feed
 from auth import auth_bp
 from views import views_bp
+from edge import edge_bp, edge_sync, init_edge_db, reload_types
+
+
+def start_refresher(app, interval, edge=False):
+    """后台线程：定期检测伪装文件变化，重载配置类型索引并同步其他进程的授权修改
+
+    边缘节点没有 config_files 和用户表，只刷新伪装文件（类型索引由同步线程维护）。
+    """
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                if decoy_store.refresh():
+                    app.logger.info("伪装响应文件已重新加载")
+                if not edge:
+                    config_types.reload()
+                    authz_index.sync()
+            except Exception:
+                app.logger.exception("后台刷新失败")
+
+    thread = threading.Thread(target=loop, name="decoy-refresher", daemon=True)
+    thread.start()
+    return thread
 
 
 def create_app():
@@ -18,32 +51,110 @@ def create_app():
     # Flask session 加密密钥
     app.secret_key = os.getenv("SECRET_KEY", "dev_key")
 
-    # 配置日志 - 每天0点自动分割
-    if not app.debug:
-        # 创建logs目录
-        if not os.path.exists('logs'):
-            os.mkdir('logs')
-        
-        # 配置日志文件轮转
-        file_handler = TimedRotatingFileHandler(
-            'logs/app.log',
-            when='midnight',  # 每天0点
-            interval=1,       # 间隔1天
-            backupCount=30,   # 保留30天的日志
-            encoding='utf-8'
+    # 日志经队列交给后台线程写入 logs/app.log（JSON Lines），请求线程不做磁盘 I/O
+    profiling.enabled = os.getenv("PROFILE_ENABLED") == "1"
+    # 按路由 cProfile 的开关和结果放在共享目录中，所有 worker 共用
+    profiling.route_profiler.directory = os.getenv("PROFILE_DIR", os.path.join("run", "profile"))
+    logsetup.payload_excerpts = os.getenv("LOG_PAYLOAD_EXCERPTS") == "1"
+    logsetup.setup_logging(
+        level=os.getenv("LOG_LEVEL", "INFO").upper(),
+        queue_size=int(os.getenv("LOG_QUEUE_SIZE", 10000)),
+        console=os.getenv("APP_DEBUG") == "1",
+        slow_log=profiling.enabled,
+        rotation=os.getenv("LOG_ROTATION", "timed"),
+    )
+    # 多进程部署时各 worker 把指标快照写到同一目录，/admin/metrics 导出全部 worker 的合计
+    metrics_dir = os.getenv("METRICS_DIR")
+    if metrics_dir:
+        metrics.registry.start_multiprocess(
+            metrics_dir, float(os.getenv("METRICS_SNAPSHOT_INTERVAL", 5))
         )
-        file_handler.setFormatter(logging.Formatter(
-            '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
-        ))
-        file_handler.setLevel(logging.INFO)
-        app.logger.addHandler(file_handler)
-        
-        app.logger.setLevel(logging.INFO)
-        app.logger.info('配置管理系统启动')
+    app.before_request(logsetup.assign_request_id)
+    app.after_request(logsetup.finish_request)
+    app.logger.info("配置管理系统启动")
+
+    # APP_MODE=edge 为只读边缘节点：从主节点增量同步配置，只提供 /api/config/<uuid>
+    edge_mode = os.getenv("APP_MODE", "primary") == "edge"
+
+    # 数据库连接池（边缘节点使用自己的本地库）
+    db_pool.configure(
+        path=os.getenv("EDGE_DB_PATH", "edge.db") if edge_mode else None,
+        max_size=int(os.getenv("DB_POOL_SIZE", 8)),
+        timeout=float(os.getenv("DB_POOL_TIMEOUT", 10)),
+        cache_size_kb=int(os.getenv("DB_CACHE_SIZE_KB", 20000)),
+        mmap_size=int(os.getenv("DB_MMAP_SIZE", 256 * 1024 * 1024)),
+    )
+    app.teardown_appcontext(close_request_connection)
+
+    # 请求耗时 / 响应字节数指标，导出在 /admin/metrics
+    app.before_request(metrics.start_request_timer)
+    app.after_request(metrics.record_request)
+
+    # 分阶段计时与慢请求日志（默认关闭，写入 logs/slow.log），以及管理员按需开启的 cProfile 抽样
+    profiling.slow_threshold_ms = float(os.getenv("SLOW_REQUEST_MS", 500))
+    app.before_request(profiling.begin_request)
+    app.after_request(profiling.end_request)
+    app.teardown_request(profiling.teardown_request)
+
+    # 配置接口缓存容量（条目数 / 总字节数）及压缩阈值
+    config_cache.configure(
+        max_entries=int(os.getenv("CONFIG_CACHE_MAX_ENTRIES", 256)),
+        max_bytes=int(os.getenv("CONFIG_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+        compress_min_size=int(os.getenv("CONFIG_COMPRESS_MIN_SIZE", 1024)),
+        max_views=int(os.getenv("CONFIG_CACHE_MAX_VIEWS", 32)),
+    )
+
+    if edge_mode:
+        return init_edge(app)
+
+    # 密码哈希专用线程池与登录失败限流
+    # 每个等待哈希结果的登录请求占住一个请求线程：默认名额（执行 + 排队）最多占四分之一线程，
+    # 其余线程始终留给 /api/config；gevent worker 按连接数计算
+    if os.getenv("WEB_WORKER_CLASS", "gthread") == "gevent":
+        hash_slots = int(os.getenv("WEB_WORKER_CONNECTIONS", 1000)) // 4
+    else:
+        hash_slots = int(os.getenv("WEB_THREADS", 8)) // 4
+    hash_slots = max(1, hash_slots)
+    hash_workers = int(os.getenv("HASH_WORKERS", min(2, hash_slots)))
+    hash_pool.configure(
+        workers=hash_workers,
+        queue_limit=int(os.getenv("HASH_QUEUE_LIMIT", max(0, hash_slots - hash_workers))),
+        timeout=float(os.getenv("HASH_TIMEOUT", 3)),
+    )
+    login_window = float(os.getenv("LOGIN_FAILURE_WINDOW", 300))
+    user_throttle.limit = int(os.getenv("LOGIN_MAX_FAILURES_PER_USER", 5))
+    user_throttle.window = login_window
+    ip_throttle.limit = int(os.getenv("LOGIN_MAX_FAILURES_PER_IP", 20))
+    ip_throttle.window = login_window
 
     # 初始化数据库
     init_db()
 
+    # 预加载伪装响应和配置类型索引，请求路径上不再读盘查库
+    decoy_store.load()
+    config_types.reload()
+    start_refresher(app, float(os.getenv("DECOY_REFRESH_INTERVAL", 5)))
+
+    # 监控配置文件和 err_return 目录，发现界面之外的修改后立即失效缓存
+    if os.getenv("WATCHER_ENABLED", "1") == "1":
+        file_watcher.poll_interval = float(os.getenv("WATCHER_POLL_INTERVAL", 2))
+        file_watcher.debounce = float(os.getenv("WATCHER_DEBOUNCE", 0.5))
+        file_watcher.start()
+
+    # 配置变化通知（长轮询 / SSE）
+    change_feed.poll_interval = float(os.getenv("FEED_POLL_INTERVAL", 0.5))
+    change_feed.max_wait = float(os.getenv("FEED_MAX_WAIT", 60))
+    change_feed.stream_seconds = float(os.getenv("FEED_STREAM_SECONDS", 300))
+    change_feed.keepalive = float(os.getenv("FEED_KEEPALIVE", 15))
+    # 默认最多占用一半线程挂起等待；gevent worker 按连接数计算
+    if os.getenv("WEB_WORKER_CLASS", "gthread") == "gevent":
+        default_waiters = int(os.getenv("WEB_WORKER_CONNECTIONS", 1000)) // 2
+    else:
+        default_waiters = int(os.getenv("WEB_THREADS", 8)) // 2
+    change_feed.max_waiters = int(os.getenv("FEED_MAX_WAITERS", max(1, default_waiters)))
+    change_feed.busy_retry = float(os.getenv("FEED_BUSY_RETRY", 5))
+    change_feed.start()
+
     # 注册蓝图
     app.register_blueprint(auth_bp)
     app.register_blueprint(views_bp)
@@ -51,9 +162,39 @@ def create_app():
     return app
 
 
+def init_edge(app):
+    """边缘节点：本地库 + 同步线程，只注册公共配置接口"""
+    primary_url = os.getenv("EDGE_PRIMARY_URL")
+    if not primary_url:
+        raise SystemExit("APP_MODE=edge 时必须设置 EDGE_PRIMARY_URL（主节点地址）")
+    init_edge_db()
+
+    # 缓存条目没有对应的本地文件，由同步线程按 uuid 失效，命中时不必 stat
+    config_cache.verify_signatures = False
+    decoy_store.load()
+    reload_types()
+    start_refresher(app, float(os.getenv("DECOY_REFRESH_INTERVAL", 5)), edge=True)
+
+    edge_sync.primary_url = primary_url
+    edge_sync.token = os.getenv("SYNC_TOKEN")
+    edge_sync.interval = float(os.getenv("EDGE_SYNC_INTERVAL", 2))
+    edge_sync.start()
+    app.logger.info("以边缘节点模式运行，主节点 %s", primary_url)
+
+    app.register_blueprint(edge_bp)
+    return app
+
+
 if __name__ == "__main__":
-    app = create_app()
+    load_dotenv()
+
+    if os.getenv("APP_DEBUG") == "1":
+        # 开发模式：单进程调试服务器，代码修改后自动重载
+        app = create_app()
+        port = int(os.getenv("APP_PORT", 5000))
+        app.run(host="0.0.0.0", port=port, debug=True)
+    else:
+        # 生产模式：多进程 / 多线程服务器
+        from serve import run_production
 
-    # 从 .env 读取端口号
-    port = int(os.getenv("APP_PORT", 5000))
-    app.run(host="0.0.0.0", port=port, debug=True)
+        run_production(create_app)
@@ -1,6 +1,6 @@
 from flask import Blueprint, render_template, request, redirect, url_for, session, flash
-from werkzeug.security import generate_password_hash, check_password_hash
 from models import get_db_connection
+from passwords import LOGIN_ATTEMPTS, HashPoolBusy, hash_pool, ip_throttle, user_throttle
 
 auth_bp = Blueprint("auth", __name__)
 
@@ -13,6 +13,15 @@ def login():
     if request.method == "POST":
         username = request.form["username"].strip()
         password = request.form["password"].strip()
+        user_key = f"user:{username}"
+        ip_key = f"ip:{request.remote_addr}"
+
+        # 失败次数过多时不再校验密码，直接拒绝
+        retry_after = max(user_throttle.retry_after(user_key), ip_throttle.retry_after(ip_key))
+        if retry_after:
+            LOGIN_ATTEMPTS.labels("login", "throttled").inc()
+            flash(f"登录失败次数过多，请 {retry_after} 秒后再试", "error")
+            return render_template("login.html"), 429, {"Retry-After": str(retry_after)}
 
         conn = get_db_connection()
         c = conn.cursor()
@@ -20,11 +29,23 @@ def login():
         user = c.fetchone()
         conn.close()
 
-        if user and check_password_hash(user["password"], password):
+        try:
+            ok = bool(user) and hash_pool.check(user["password"], password)
+        except HashPoolBusy:
+            LOGIN_ATTEMPTS.labels("login", "overloaded").inc()
+            flash("登录请求过多，请稍后再试", "error")
+            return render_template("login.html"), 503, {"Retry-After": "5"}
+
+        if ok:
+            LOGIN_ATTEMPTS.labels("login", "ok").inc()
+            user_throttle.reset(user_key)
             session["user_id"] = user["id"]
             session["username"] = username
             return redirect(url_for("views.index"))
         else:
+            LOGIN_ATTEMPTS.labels("login", "failed").inc()
+            user_throttle.fail(user_key)
+            ip_throttle.fail(ip_key)
             flash("用户名或密码错误", "error")
 
     return render_template("login.html")
@@ -56,18 +77,37 @@ def change_password():
             flash("两次输入的新密码不一致", "error")
             return redirect(url_for("auth.change_password"))
 
+        user_key = f"user:{session.get('username')}"
+        retry_after = user_throttle.retry_after(user_key)
+        if retry_after:
+            LOGIN_ATTEMPTS.labels("change_password", "throttled").inc()
+            flash(f"原密码错误次数过多，请 {retry_after} 秒后再试", "error")
+            return redirect(url_for("auth.change_password"))
+
         conn = get_db_connection()
         c = conn.cursor()
         c.execute("SELECT password FROM users WHERE id=?", (session["user_id"],))
         user = c.fetchone()
 
-        if not user or not check_password_hash(user["password"], old_password):
+        try:
+            ok = bool(user) and hash_pool.check(user["password"], old_password)
+            # 新密码的哈希同样放到线程池里计算
+            new_hash = hash_pool.generate(new_password) if ok else None
+        except HashPoolBusy:
+            conn.close()
+            LOGIN_ATTEMPTS.labels("change_password", "overloaded").inc()
+            flash("请求过多，请稍后再试", "error")
+            return redirect(url_for("auth.change_password"))
+
+        if not ok:
+            LOGIN_ATTEMPTS.labels("change_password", "failed").inc()
+            user_throttle.fail(user_key)
             flash("原密码错误", "error")
             conn.close()
             return redirect(url_for("auth.change_password"))
 
         # 更新密码
-        new_hash = generate_password_hash(new_password)
+        LOGIN_ATTEMPTS.labels("change_password", "ok").inc()
         c.execute("UPDATE users SET password=? WHERE id=?", (new_hash, session["user_id"]))
         conn.commit()
         conn.close()
@@ -0,0 +1,150 @@
+import threading
+
+from models import get_db_connection
+
+ADMIN_USER_ID = 1
+
+
+class Grant:
+    """一个用户的授权：能否修改热更地址（users.permission）以及可访问的配置文件ID"""
+
+    __slots__ = ("user_id", "can_edit", "file_ids")
+
+    def __init__(self, user_id, can_edit, file_ids):
+        self.user_id = user_id
+        self.can_edit = can_edit
+        self.file_ids = file_ids
+
+    @property
+    def is_admin(self):
+        return self.user_id == ADMIN_USER_ID
+
+    def allows(self, file_id):
+        return self.is_admin or file_id in self.file_ids
+
+
+class AuthzIndex:
+    """进程内的授权索引：user_id -> Grant
+
+    首次使用时两条查询整体加载全部用户；manage_permissions / add_user 提交后
+    按用户精确失效，下次访问只重新加载该用户。
+    其他 worker 进程通过 authz_version 表的版本号感知修改，由后台线程定期 sync()。
+    """
+
+    def __init__(self):
+        self._grants = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _load_all(self):
+        conn = get_db_connection()
+        c = conn.cursor()
+        c.execute("SELECT version FROM authz_version WHERE id = 1")
+        row = c.fetchone()
+        version = row[0] if row else None
+        c.execute("SELECT id, permission FROM users WHERE delete_time IS NULL")
+        grants = {
+            user_id: Grant(user_id, permission == 1, set())
+            for user_id, permission in c.fetchall()
+        }
+        c.execute("SELECT user_id, config_file_id FROM user_config_permissions")
+        for user_id, file_id in c.fetchall():
+            grant = grants.get(user_id)
+            if grant is not None:
+                grant.file_ids.add(file_id)
+        conn.close()
+        for grant in grants.values():
+            grant.file_ids = frozenset(grant.file_ids)
+        return version, grants
+
+    def _load_user(self, user_id):
+        conn = get_db_connection()
+        c = conn.cursor()
+        c.execute(
+            "SELECT permission FROM users WHERE id = ? AND delete_time IS NULL", (user_id,)
+        )
+        row = c.fetchone()
+        grant = None
+        if row is not None:
+            c.execute(
+                "SELECT config_file_id FROM user_config_permissions WHERE user_id = ?",
+                (user_id,),
+            )
+            grant = Grant(user_id, row[0] == 1, frozenset(r[0] for r in c.fetchall()))
+        conn.close()
+        return grant
+
+    def get(self, user_id):
+        """返回用户的 Grant，用户不存在（或已删除）时返回 None"""
+        if user_id is None:
+            return None
+        grants = self._grants
+        if grants is None:
+            with self._lock:
+                if self._grants is None:
+                    self._version, self._grants = self._load_all()
+                grants = self._grants
+        if user_id in grants:
+            return grants[user_id]
+        grant = self._load_user(user_id)
+        if grant is not None:
+            with self._lock:
+                if self._grants is grants:
+                    # 整体替换字典引用，读者无需加锁
+                    self._grants = {**grants, user_id: grant}
+        return grant
+
+    def invalidate(self, user_id):
+        """某个用户的授权已修改（调用方已提交事务）"""
+        with self._lock:
+            if self._grants is not None and user_id in self._grants:
+                grants = dict(self._grants)
+                del grants[user_id]
+                self._grants = grants
+
+    def clear(self):
+        with self._lock:
+            self._grants = None
+
+    def sync(self):
+        """其他进程修改过授权（版本号变化）时整体丢弃，下次访问重新加载"""
+        if self._grants is None:
+            return
+        conn = get_db_connection()
+        c = conn.cursor()
+        c.execute("SELECT version FROM authz_version WHERE id = 1")
+        row = c.fetchone()
+        conn.close()
+        if row is not None and row[0] != self._version:
+            self.clear()
+
+
+def bump_version(cursor):
+    """在修改授权的事务内调用，通知其他进程重新加载"""
+    cursor.execute("UPDATE authz_version SET version = version + 1 WHERE id = 1")
+
+
+def can_access(user_id, file_id, edit=False):
+    """视图统一使用的授权检查：用户能否访问该配置文件，edit=True 时还要求有修改权限（热更地址）"""
+    grant = authz_index.get(user_id)
+    if grant is None or not grant.allows(file_id):
+        return False
+    return grant.can_edit or not edit
+
+
+def is_admin(user_id):
+    """管理员检查（管理页面、批量修改、用户和权限管理），同样取自授权索引"""
+    grant = authz_index.get(user_id)
+    return grant is not None and grant.is_admin
+
+
+def accessible_file_ids(user_id):
+    """列表页的可见范围：管理员返回 None 表示全部，其他用户返回被授权的配置文件ID"""
+    grant = authz_index.get(user_id)
+    if grant is None:
+        return frozenset()
+    return None if grant.is_admin else grant.file_ids
+
+
+# 进程级单例
+authz_index = AuthzIndex()
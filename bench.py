@@ -0,0 +1,618 @@
+"""公共配置接口的本地压测工具
+
+在临时目录中启动一份独立的服务（生产模式，独立的 data.db），生成指定数量和大小的
+配置文件并通过「新增配置文件」接口登记，然后按场景并发请求，输出 JSON 结果：
+
+    python bench.py --configs 20 --servers 500 --encoding mixed --output before.json
+    python bench.py compare before.json after.json
+    python bench.py formats /path/to/largest_qu.txt   # 各传输表示的大小与编解码耗时
+
+也可以用 --url 压测一个已经运行的服务（需提供管理员账号，会在该服务中新增配置记录）。
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import socket
+import sqlite3
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import http.client
+from urllib.parse import urlencode, urlsplit
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DALVIK_UA = "Dalvik/2.1.0 (Linux; U; Android 12; Pixel 6 Build/SQ3A.220705.003)"
+BROWSER_UA = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0"
+SCENARIOS = (
+    "api_dalvik",
+    "api_decoy",
+    "api_mixed",
+    "api_not_modified",
+    "api_json_min",
+    "api_msgpack",
+    "index",
+    "manage_permissions",
+    "edit_content",
+)
+
+
+# ===========================
+# 测试数据
+# ===========================
+def make_config(index, servers):
+    """生成一份带 servers 台服务器的配置（含中文服务器名，用于区分编码）"""
+    return {
+        "gmResURL": f"http://res.example.com/{index}/",
+        "gmWebResURL": f"http://web.example.com/{index}/",
+        "gmInitResURL": f"http://init.example.com/{index}/",
+        "serverData": [
+            {
+                "srvid": str(n + 1),
+                "srvname": f"{n + 1}服-测试区",
+                "srvip": f"10.{index % 256}.{n // 256 % 256}.{n % 256}",
+                "port": str(8000 + n % 1000),
+                "urlsuffix": "",
+                "state": random.choice(["new", "hot", "maintain", "normal"]),
+                "tag": n % 5,
+            }
+            for n in range(servers)
+        ],
+    }
+
+
+def write_configs(directory, count, servers, encoding):
+    """写出 count 个配置文件，encoding 为 utf-8 / gbk / mixed（交替），返回路径列表"""
+    paths = []
+    for i in range(count):
+        file_encoding = encoding if encoding != "mixed" else ("utf-8", "gbk")[i % 2]
+        path = os.path.join(directory, f"bench_{i}.txt")
+        with open(path, "w", encoding=file_encoding) as f:
+            json.dump(make_config(i, servers), f, ensure_ascii=False, indent=4)
+        paths.append(path)
+    return paths
+
+
+# ===========================
+# HTTP 客户端
+# ===========================
+class Client:
+    """单线程使用的 keep-alive 连接，断开后自动重连"""
+
+    def __init__(self, base_url, cookie=None):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.cookie = cookie
+        self.conn = None
+
+    def request(self, method, path, headers=None, body=None):
+        headers = dict(headers or {})
+        if self.cookie:
+            headers["Cookie"] = self.cookie
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            try:
+                self.conn.request(method, path, body=body, headers=headers)
+                resp = self.conn.getresponse()
+                data = resp.read()
+                if resp.getheader("Connection", "").lower() == "close":
+                    self.close()
+                return resp, data
+            except (http.client.HTTPException, ConnectionError, OSError):
+                self.close()
+                if attempt:
+                    raise
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def login(base_url, username, password):
+    """登录并返回 session cookie"""
+    client = Client(base_url)
+    body = urlencode({"username": username, "password": password})
+    resp, _ = client.request(
+        "POST",
+        "/login",
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+        body=body,
+    )
+    client.close()
+    cookie = resp.getheader("Set-Cookie")
+    if resp.status != 302 or not cookie:
+        raise SystemExit(f"登录失败（HTTP {resp.status}），请检查管理员账号")
+    return cookie.split(";", 1)[0]
+
+
+def register_configs(base_url, cookie, paths):
+    """通过「新增配置文件」接口登记配置"""
+    client = Client(base_url, cookie)
+    for i, path in enumerate(paths):
+        body = urlencode(
+            {
+                "type": "qu" if i % 2 == 0 else "modlist",
+                "name": f"bench_{i}",
+                "version": "1",
+                "path": path,
+                "remark": "bench",
+            }
+        )
+        resp, _ = client.request(
+            "POST",
+            "/add_config",
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+            body=body,
+        )
+        if resp.status != 302:
+            raise SystemExit(f"新增配置失败（HTTP {resp.status}）: {path}")
+    client.close()
+
+
+def lookup_configs(db_path, paths):
+    """从数据库查出刚登记的配置 (id, uuid)"""
+    conn = sqlite3.connect(db_path)
+    placeholders = ",".join("?" * len(paths))
+    rows = conn.execute(
+        f"""
+        SELECT id, uuid FROM config_files
+        WHERE path IN ({placeholders}) AND delete_time IS NULL
+        ORDER BY id
+        """,
+        paths,
+    ).fetchall()
+    conn.close()
+    return rows
+
+
+# ===========================
+# 被测服务
+# ===========================
+def start_server(workdir, port, workers, threads):
+    """在 workdir 中以生产模式启动 app.py，返回子进程"""
+    env = dict(os.environ)
+    env.update(
+        {
+            "APP_DEBUG": "0",
+            "APP_HOST": "127.0.0.1",
+            "APP_PORT": str(port),
+            "WEB_WORKERS": str(workers),
+            "WEB_THREADS": str(threads),
+            "SECRET_KEY": "bench",
+        }
+    )
+    log = open(os.path.join(workdir, "server.log"), "wb")
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(BASE_DIR, "app.py")],
+        cwd=workdir,
+        env=env,
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"服务启动失败，日志见 {log.name}")
+        try:
+            resp, _ = Client(base_url).request("GET", "/login")
+            if resp.status == 200:
+                return proc, base_url
+        except OSError:
+            pass
+        time.sleep(0.2)
+    proc.terminate()
+    raise SystemExit("等待服务启动超时")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# ===========================
+# 压测
+# ===========================
+def build_request(scenario, configs, etags, rng):
+    """返回 (method, path, headers)；后台页面依赖客户端带上的管理员 cookie"""
+    file_id, file_uuid = rng.choice(configs)
+    accept = {"Accept-Encoding": "gzip, br"}
+    if scenario == "api_dalvik":
+        return "GET", f"/api/config/{file_uuid}", {"User-Agent": DALVIK_UA, **accept}
+    if scenario == "api_decoy":
+        return "GET", f"/api/config/{file_uuid}", {"User-Agent": BROWSER_UA, **accept}
+    if scenario == "api_mixed":
+        ua = DALVIK_UA if rng.random() < 0.5 else BROWSER_UA
+        return "GET", f"/api/config/{file_uuid}", {"User-Agent": ua, **accept}
+    if scenario == "api_json_min":
+        headers = {"User-Agent": DALVIK_UA, **accept}
+        return "GET", f"/api/config/{file_uuid}?format=json", headers
+    if scenario == "api_msgpack":
+        headers = {"User-Agent": DALVIK_UA, "Accept": "application/msgpack", **accept}
+        return "GET", f"/api/config/{file_uuid}", headers
+    if scenario == "api_not_modified":
+        headers = {"User-Agent": DALVIK_UA, **accept}
+        if file_uuid in etags:
+            headers["If-None-Match"] = etags[file_uuid]
+        return "GET", f"/api/config/{file_uuid}", headers
+    if scenario == "index":
+        return "GET", "/", {}
+    if scenario == "manage_permissions":
+        return "GET", "/manage_permissions", {}
+    if scenario == "edit_content":
+        return "GET", f"/edit_content/{file_id}", {}
+    raise ValueError(scenario)
+
+
+def percentile(sorted_values, p):
+    """最近秩法分位数"""
+    if not sorted_values:
+        return None
+    k = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[k]
+
+
+def run_scenario(scenario, base_url, configs, cookie, concurrency, duration, warmup):
+    # 先取一遍 ETag，304 场景带上 If-None-Match
+    etags = {}
+    if scenario == "api_not_modified":
+        client = Client(base_url)
+        for _, file_uuid in configs:
+            resp, _ = client.request(
+                "GET",
+                f"/api/config/{file_uuid}",
+                {"User-Agent": DALVIK_UA, "Accept-Encoding": "gzip, br"},
+            )
+            if resp.getheader("ETag"):
+                etags[file_uuid] = resp.getheader("ETag")
+        client.close()
+
+    latencies = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    received = [0] * concurrency
+    start_at = time.perf_counter() + warmup
+    stop_at = start_at + duration
+
+    def worker(n):
+        rng = random.Random(n)
+        client = Client(base_url, cookie)
+        while True:
+            method, path, headers = build_request(scenario, configs, etags, rng)
+            started = time.perf_counter()
+            if started >= stop_at:
+                break
+            try:
+                resp, data = client.request(method, path, headers)
+                ok = resp.status < 400
+            except Exception:
+                ok = False
+                data = b""
+            finished = time.perf_counter()
+            # 预热阶段的请求不计入结果
+            if started >= start_at:
+                latencies[n].append(finished - started)
+                received[n] += len(data)
+                if not ok:
+                    errors[n] += 1
+        client.close()
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    values = sorted(v for per_thread in latencies for v in per_thread)
+    count = len(values)
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 3)
+
+    return {
+        "requests": count,
+        "errors": sum(errors),
+        "throughput_rps": round(count / duration, 1),
+        "bytes_received": sum(received),
+        "latency_ms": {
+            "mean": ms(sum(values) / count) if count else None,
+            "p50": ms(percentile(values, 50)),
+            "p95": ms(percentile(values, 95)),
+            "p99": ms(percentile(values, 99)),
+            "max": ms(values[-1]) if values else None,
+        },
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BASE_DIR,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    random.seed(args.seed)
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    proc = None
+    try:
+        config_dir = os.path.join(workdir, "configs")
+        os.mkdir(config_dir)
+        paths = write_configs(config_dir, args.configs, args.servers, args.encoding)
+
+        if args.url:
+            base_url = args.url.rstrip("/")
+            db_path = args.db
+        else:
+            proc, base_url = start_server(
+                workdir, args.port or free_port(), args.workers, args.threads
+            )
+            db_path = os.path.join(workdir, "data.db")
+
+        cookie = login(base_url, args.username, args.password)
+        register_configs(base_url, cookie, paths)
+        configs = lookup_configs(db_path, paths)
+        if not configs:
+            raise SystemExit("未找到登记的配置，--url 模式需要用 --db 指定该服务的 data.db")
+
+        results = {}
+        for scenario in args.scenarios:
+            print(f"running {scenario} ...", file=sys.stderr)
+            results[scenario] = run_scenario(
+                scenario,
+                base_url,
+                configs,
+                cookie,
+                args.concurrency,
+                args.duration,
+                args.warmup,
+            )
+
+        report = {
+            "meta": {
+                "commit": git_commit(),
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "params": {
+                    "configs": args.configs,
+                    "servers": args.servers,
+                    "encoding": args.encoding,
+                    "concurrency": args.concurrency,
+                    "duration": args.duration,
+                    "warmup": args.warmup,
+                    "workers": None if args.url else args.workers,
+                    "threads": None if args.url else args.threads,
+                    "seed": args.seed,
+                },
+                "config_bytes": sum(os.path.getsize(p) for p in paths) // max(len(paths), 1),
+            },
+            "scenarios": results,
+        }
+        text = json.dumps(report, ensure_ascii=False, indent=2)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                f.write(text + "\n")
+        print(text)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            try:
+                proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        # --url 模式下配置文件仍被远端服务登记引用，保留目录
+        if not args.url and not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+        elif args.keep or args.url:
+            print(f"测试数据保留在 {workdir}", file=sys.stderr)
+
+
+def compare(args):
+    """对比两次结果：吞吐和各分位延迟的变化百分比"""
+    with open(args.before, encoding="utf-8") as f:
+        before = json.load(f)
+    with open(args.after, encoding="utf-8") as f:
+        after = json.load(f)
+
+    def change(old, new):
+        if not old or new is None:
+            return None
+        return round((new - old) / old * 100, 1)
+
+    diff = {}
+    for scenario, new in after["scenarios"].items():
+        old = before["scenarios"].get(scenario)
+        if old is None:
+            continue
+        diff[scenario] = {
+            "throughput_rps": change(old["throughput_rps"], new["throughput_rps"]),
+            **{
+                key: change(old["latency_ms"][key], new["latency_ms"][key])
+                for key in ("p50", "p95", "p99")
+            },
+        }
+    print(
+        json.dumps(
+            {
+                "before": before["meta"].get("commit"),
+                "after": after["meta"].get("commit"),
+                "change_percent": diff,
+            },
+            ensure_ascii=False,
+            indent=2,
+        )
+    )
+
+
+# ===========================
+# 传输表示对比
+# ===========================
+def _timed(func, arg, repeat):
+    """重复 repeat 次取最短耗时（毫秒）和最后一次结果"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(arg)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best * 1000, 3), result
+
+
+def formats(args):
+    """对比原文 / 压缩 JSON / MessagePack 的大小、服务端生成耗时和客户端解析耗时
+
+    服务端每个内容版本只生成一次紧凑表示，encode_ms 是这一次的成本；
+    decode_ms 是启动器每次下载后解析的成本。
+    """
+    import gzip
+
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+    try:
+        import msgpack
+    except ImportError:
+        msgpack = None
+        print("未安装 msgpack，跳过 MessagePack（pip install msgpack）", file=sys.stderr)
+
+    paths = list(args.files)
+    workdir = None
+    if not paths:
+        workdir = tempfile.mkdtemp(prefix="bench_formats_")
+        paths = write_configs(workdir, 1, args.servers, "utf-8")
+
+    results = {}
+    for path in paths:
+        with open(path, "rb") as f:
+            raw = f.read()
+        for encoding in ("utf-8-sig", "gbk"):
+            try:
+                text = raw.decode(encoding)
+                break
+            except UnicodeDecodeError:
+                continue
+        else:
+            raise SystemExit(f"无法解码 {path}")
+        decode_ms, data = _timed(json.loads, text, args.repeat)
+
+        reps = {"raw": (raw, decode_ms, 0.0)}
+        encode_ms, body = _timed(
+            lambda d: json.dumps(d, ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+            data,
+            args.repeat,
+        )
+        reps["json"] = (body, _timed(json.loads, body, args.repeat)[0], encode_ms)
+        if msgpack is not None:
+            encode_ms, body = _timed(
+                lambda d: msgpack.packb(d, use_bin_type=True), data, args.repeat
+            )
+            reps["msgpack"] = (body, _timed(msgpack.unpackb, body, args.repeat)[0], encode_ms)
+
+        result = {}
+        for name, (body, decode_ms, encode_ms) in reps.items():
+            sizes = {"identity": len(body), "gzip": len(gzip.compress(body, 9, mtime=0))}
+            if brotli is not None:
+                sizes["br"] = len(brotli.compress(body, quality=11))
+            result[name] = {
+                "bytes": sizes,
+                "percent_of_raw": round(len(body) / len(raw) * 100, 1),
+                "encode_ms": encode_ms,
+                "decode_ms": decode_ms,
+            }
+        results[os.path.basename(path)] = result
+
+    if workdir is not None:
+        shutil.rmtree(workdir, ignore_errors=True)
+    output = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "repeat": args.repeat,
+        },
+        "files": results,
+    }
+    text = json.dumps(output, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="配置接口本地压测")
+    sub = parser.add_subparsers(dest="command")
+
+    cmp_parser = sub.add_parser("compare", help="对比两次压测结果")
+    cmp_parser.add_argument("before")
+    cmp_parser.add_argument("after")
+
+    fmt_parser = sub.add_parser(
+        "formats", help="对比原文、压缩 JSON、MessagePack 的大小和编解码耗时"
+    )
+    fmt_parser.add_argument(
+        "files", nargs="*", help="配置文件，默认生成一份 --servers 台服务器的配置"
+    )
+    fmt_parser.add_argument("--servers", type=int, default=5000, help="生成配置的服务器数")
+    fmt_parser.add_argument("--repeat", type=int, default=20, help="每项计时重复次数，取最短")
+    fmt_parser.add_argument("--output", help="结果另存为 JSON 文件")
+
+    parser.add_argument("--configs", type=int, default=20, help="配置文件数量")
+    parser.add_argument("--servers", type=int, default=200, help="每个配置的服务器数")
+    parser.add_argument(
+        "--encoding", choices=("utf-8", "gbk", "mixed"), default="mixed", help="配置文件编码"
+    )
+    parser.add_argument("--concurrency", type=int, default=16, help="并发连接数")
+    parser.add_argument("--duration", type=float, default=10, help="每个场景的计时秒数")
+    parser.add_argument("--warmup", type=float, default=2, help="每个场景的预热秒数")
+    parser.add_argument(
+        "--scenarios",
+        type=lambda s: s.split(","),
+        default=list(SCENARIOS),
+        help="逗号分隔，可选: " + ",".join(SCENARIOS),
+    )
+    parser.add_argument("--workers", type=int, default=2, help="被测服务的 worker 进程数")
+    parser.add_argument("--threads", type=int, default=8, help="每个 worker 的线程数")
+    parser.add_argument("--port", type=int, help="被测服务端口，默认随机")
+    parser.add_argument("--url", help="压测已运行的服务，例如 http://127.0.0.1:5000")
+    parser.add_argument("--db", help="--url 模式下该服务的 data.db 路径（必填）")
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="admin123")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="结果另存为 JSON 文件")
+    parser.add_argument("--keep", action="store_true", help="保留临时目录（含服务日志）")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        compare(args)
+        return
+    if args.command == "formats":
+        formats(args)
+        return
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"未知场景: {','.join(sorted(unknown))}")
+    if args.url and not args.db:
+        # 测试数据直接写入被测服务的数据库，只给地址无法准备配置
+        parser.error("--url 需要同时指定 --db（该服务的 data.db 路径）")
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,440 @@
+import gzip
+import json
+import time
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from werkzeug.http import http_date
+
+import metrics
+import profiling
+from models import get_db_connection
+from storage import file_signature
+
+try:
+    import brotli
+except ImportError:  # brotli 为可选依赖，未安装时只提供 gzip
+    brotli = None
+
+# 按优先顺序排列，协商时同等权重下优先 br
+COMPRESSORS = {}
+if brotli is not None:
+    COMPRESSORS["br"] = lambda data: brotli.compress(data, quality=11)
+COMPRESSORS["gzip"] = lambda data: gzip.compress(data, compresslevel=9, mtime=0)
+
+# 筛选视图只用低级别 gzip：参数组合由公共请求决定，不值得为每种组合做最高级别压缩
+FAST_COMPRESSORS = {"gzip": lambda data: gzip.compress(data, compresslevel=1, mtime=0)}
+
+try:
+    import msgpack
+except ImportError:  # msgpack 为可选依赖，未安装时只提供压缩 JSON
+    msgpack = None
+
+
+def _minified_json(data):
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+# 公共接口可协商的紧凑表示：名称 -> (Content-Type, 由解析后的配置生成字节)
+# 原文（text/plain，与磁盘文件逐字节相同）始终可用，不在此列
+FORMATS = {"json": ("application/json", _minified_json)}
+if msgpack is not None:
+    FORMATS["msgpack"] = (
+        "application/msgpack",
+        lambda data: msgpack.packb(data, use_bin_type=True),
+    )
+
+RAW_CONTENT_TYPE = "text/plain; charset=utf-8"
+
+
+class Variant:
+    """同一内容版本的一种传输表示（原文 / gzip / br）"""
+
+    __slots__ = ("body", "etag", "headers")
+
+    def __init__(self, body, etag, headers):
+        self.body = body
+        self.etag = etag
+        self.headers = headers
+
+
+class CachedPayload:
+    """一份已缓存的配置响应：预编码的字节、生成时的文件签名以及缓存校验头
+
+    ETag 为内容摘要（强校验），Last-Modified 取文件 mtime，
+    两者以及各压缩变体都只在条目写入缓存时计算一次。
+    """
+
+    __slots__ = (
+        "file_id",
+        "uuid",
+        "type",
+        "path",
+        "signature",
+        "body",
+        "content_type",
+        "etag",
+        "last_modified",
+        "variants",
+        "_parsed",
+        "_search_keys",
+        "views",
+        "selections",
+        "candidates",
+    )
+
+    def __init__(
+        self, file_id, uuid, type_, path, signature, body, content_type=RAW_CONTENT_TYPE
+    ):
+        self.file_id = file_id
+        self.uuid = uuid
+        self.type = type_
+        self.path = path
+        self.signature = signature
+        self.body = body
+        self.content_type = content_type
+        self.etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+        self.last_modified = (
+            datetime.fromtimestamp(signature[0] // 1_000_000_000, timezone.utc)
+            if signature
+            else None
+        )
+        self.variants = {"identity": self._make_variant(body, "identity")}
+        self._parsed = None
+        self._search_keys = None
+        # (选中服务器的摘要或 None, 表示) -> 对应的 CachedPayload，由 ConfigPayloadCache.view 维护
+        self.views = None
+        # 筛选参数键 -> 选中服务器的摘要；只出现过一次、尚未缓存的筛选视图键
+        self.selections = None
+        self.candidates = None
+
+    def parsed(self):
+        """解析后的配置（只读，同一内容版本只解析一次）；修改请自行重新解析"""
+        if self._parsed is None:
+            started = time.perf_counter()
+            self._parsed = json.loads(self.body.decode("utf-8-sig"))
+            profiling.add("json_parse", time.perf_counter() - started)
+        return self._parsed
+
+    def servers(self):
+        servers = self.parsed().get("serverData") if isinstance(self.parsed(), dict) else None
+        return servers if isinstance(servers, list) else []
+
+    def search_keys(self):
+        """每台服务器 srvid/srvname/srvip 拼成的小写检索串，按需生成一次"""
+        if self._search_keys is None:
+            self._search_keys = [
+                "\n".join(
+                    str(srv.get(name, "")) for name in ("srvid", "srvname", "srvip")
+                ).lower()
+                if isinstance(srv, dict)
+                else ""
+                for srv in self.servers()
+            ]
+        return self._search_keys
+
+    def _make_variant(self, body, encoding):
+        etag = self.etag if encoding == "identity" else f"{self.etag}-{encoding}"
+        headers = {
+            "Content-Type": self.content_type,
+            "ETag": f'"{etag}"',
+            # 同一 URL 按 Accept 协商表示、按 Accept-Encoding 协商压缩
+            "Vary": "Accept, Accept-Encoding",
+        }
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        if self.last_modified is not None:
+            headers["Last-Modified"] = http_date(self.last_modified)
+        return Variant(body, etag, headers)
+
+    def compress(self, min_size, compressors=COMPRESSORS):
+        """预先生成压缩变体，小于 min_size 的内容只保留原文"""
+        if len(self.body) < min_size:
+            return
+        for encoding, compress in compressors.items():
+            if encoding not in self.variants:
+                self.variants[encoding] = self._make_variant(
+                    compress(self.body), encoding
+                )
+
+    def select(self, accept_encodings):
+        """按 Accept-Encoding 选择变体，没有可用压缩时返回原文"""
+        if len(self.variants) > 1:
+            # 压缩变体排在前面，同等权重时优先压缩
+            offers = [e for e in self.variants if e != "identity"] + ["identity"]
+            return self.variants[accept_encodings.best_match(offers, "identity")]
+        return self.variants["identity"]
+
+    @property
+    def size(self):
+        size = sum(len(v.body) for v in self.variants.values())
+        if self.views:
+            size += sum(view.size for view in self.views.values())
+        return size
+
+
+class ConfigPayloadCache:
+    """uuid -> 预编码响应字节的进程级 LRU 缓存
+
+    命中时会先比对文件签名，文件被外部修改、替换或删除后自动失效；
+    同时按条目数和总字节数两个上限淘汰最久未使用的条目。
+    文件监控（watcher.py）以 inotify 覆盖全部配置目录时会关闭 verify_signatures，
+    由监控线程主动失效，命中时不再 stat 文件。
+    """
+
+    def __init__(
+        self,
+        max_entries=256,
+        max_bytes=64 * 1024 * 1024,
+        compress_min_size=1024,
+        max_views=32,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.compress_min_size = compress_min_size
+        self.max_views = max_views
+        self.verify_signatures = True
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # uuid -> CachedPayload
+        self._uuids_by_id = {}  # file_id -> uuid
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(
+        self, max_entries=None, max_bytes=None, compress_min_size=None, max_views=None
+    ):
+        """调整容量上限和压缩阈值，超出部分立即淘汰"""
+        with self._lock:
+            if max_entries is not None:
+                self.max_entries = max_entries
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            if compress_min_size is not None:
+                self.compress_min_size = compress_min_size
+            if max_views is not None:
+                self.max_views = max_views
+            self._evict_locked()
+
+    def get(self, uuid):
+        """取出仍然有效的缓存条目，文件签名不一致时丢弃并返回 None"""
+        with self._lock:
+            entry = self._entries.get(uuid)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        # stat 放在锁外，避免慢盘阻塞其他请求
+        if self.verify_signatures and file_signature(entry.path) != entry.signature:
+            self._discard(entry)
+            self.misses += 1
+            return None
+
+        with self._lock:
+            if self._entries.get(uuid) is entry:
+                self._entries.move_to_end(uuid)
+        self.hits += 1
+        return entry
+
+    def put(self, entry):
+        """生成压缩变体后写入缓存，超出单条上限的负载不缓存"""
+        entry.compress(self.compress_min_size)
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(entry.uuid, None)
+            if old is not None:
+                self._total_bytes -= old.size
+                self._uuids_by_id.pop(old.file_id, None)
+            self._entries[entry.uuid] = entry
+            self._uuids_by_id[entry.file_id] = entry.uuid
+            self._total_bytes += entry.size
+            self._evict_locked()
+
+    def selection(self, entry, server_filter):
+        """筛选参数对应的视图键：选中服务器下标的摘要
+
+        写法不同但选中同一批服务器的参数（例如 srvid_max 超出最大 srvid 的各种取值、
+        超出末页的 page）共用一个视图；参数键到摘要的映射最多保留 max_views * 4 个。
+        """
+        selections = entry.selections
+        if selections is not None:
+            digest = selections.get(server_filter.key)
+            if digest is not None:
+                return digest
+        indices = server_filter.select(entry.servers())
+        digest = hashlib.blake2b(array("I", indices).tobytes(), digest_size=16).digest()
+        with self._lock:
+            if entry.selections is None:
+                entry.selections = OrderedDict()
+            entry.selections[server_filter.key] = digest
+            while len(entry.selections) > self.max_views * 4:
+                entry.selections.popitem(last=False)
+        return digest
+
+    def view(self, entry, key, build, filtered=False):
+        """entry 的一个派生视图（筛选结果或紧凑表示）：同一内容版本每个键最多缓存一次
+
+        视图挂在条目上，随条目一起失效和淘汰，占用计入缓存总字节数；
+        每个条目最多保留 max_views 个视图，超出时丢弃最早生成的。
+        filtered 为真（筛选视图）时，键第一次出现只生成不缓存也不压缩，
+        第二次出现才缓存，并且只做低级别 gzip，避免一次性的参数组合反复占用 CPU 和缓存。
+        """
+        views = entry.views
+        if views is not None:
+            view = views.get(key)
+            if view is not None:
+                return view
+
+        if filtered:
+            with self._lock:
+                if entry.candidates is None:
+                    entry.candidates = OrderedDict()
+                first = entry.candidates.pop(key, None) is None
+                if first:
+                    entry.candidates[key] = True
+                    while len(entry.candidates) > self.max_views * 4:
+                        entry.candidates.popitem(last=False)
+            if first:
+                return build()
+
+        # 生成和压缩放在锁外，并发请求同一视图时可能重复生成，以先写入的为准
+        view = build()
+        view.compress(self.compress_min_size, FAST_COMPRESSORS if filtered else COMPRESSORS)
+        with self._lock:
+            if entry.views is None:
+                entry.views = OrderedDict()
+            existing = entry.views.get(key)
+            if existing is not None:
+                return existing
+            cached = self._entries.get(entry.uuid) is entry
+            entry.views[key] = view
+            if cached:
+                self._total_bytes += view.size
+            while len(entry.views) > self.max_views:
+                _, old = entry.views.popitem(last=False)
+                if cached:
+                    self._total_bytes -= old.size
+            if cached:
+                self._evict_locked()
+        return view
+
+    def uuids(self):
+        with self._lock:
+            return list(self._entries)
+
+    def invalidate(self, uuid):
+        """按 uuid 失效（其他 worker 修改或删除了该配置时由 change_feed 调用）"""
+        with self._lock:
+            entry = self._entries.pop(uuid, None)
+            if entry is not None:
+                self._uuids_by_id.pop(entry.file_id, None)
+                self._total_bytes -= entry.size
+
+    def invalidate_file(self, file_id):
+        """按 config_files.id 失效（编辑内容、编辑元数据、删除时调用）"""
+        with self._lock:
+            uuid = self._uuids_by_id.pop(file_id, None)
+            if uuid is None:
+                return
+            entry = self._entries.pop(uuid, None)
+            if entry is not None:
+                self._total_bytes -= entry.size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._uuids_by_id.clear()
+            self._total_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "verify_signatures": self.verify_signatures,
+            }
+
+    def _discard(self, entry):
+        with self._lock:
+            if self._entries.get(entry.uuid) is entry:
+                del self._entries[entry.uuid]
+                self._uuids_by_id.pop(entry.file_id, None)
+                self._total_bytes -= entry.size
+
+    def _evict_locked(self):
+        while self._entries and (
+            len(self._entries) > self.max_entries
+            or self._total_bytes > self.max_bytes
+        ):
+            _, old = self._entries.popitem(last=False)
+            self._uuids_by_id.pop(old.file_id, None)
+            self._total_bytes -= old.size
+            self.evictions += 1
+
+
+class ConfigTypeIndex:
+    """有效配置的 uuid -> type 映射
+
+    伪装响应只需要知道配置类型，用这份内存索引代替每次请求查库。
+    新增/编辑/删除配置时同步更新，后台线程定期整体重载以同步其他进程的修改。
+    """
+
+    def __init__(self):
+        self._types = {}
+
+    def reload(self):
+        conn = get_db_connection()
+        c = conn.cursor()
+        c.execute("SELECT uuid, type FROM config_files WHERE delete_time IS NULL")
+        types = {row["uuid"]: row["type"] for row in c.fetchall()}
+        conn.close()
+        self.replace(types)
+
+    def replace(self, types):
+        # 整体替换引用，读者无需加锁
+        self._types = types
+
+    def get(self, uuid):
+        return self._types.get(uuid)
+
+    def set(self, uuid, type_):
+        types = dict(self._types)
+        types[uuid] = type_
+        self._types = types
+
+
+# 进程级单例
+config_cache = ConfigPayloadCache()
+config_types = ConfigTypeIndex()
+
+metrics.registry.callback(
+    "config_cache_lookups_total",
+    "配置响应缓存的查找次数（hit / miss）",
+    "counter",
+    lambda: {
+        (("result", "hit"),): config_cache.hits,
+        (("result", "miss"),): config_cache.misses,
+    },
+)
+metrics.registry.callback(
+    "config_cache_evictions_total",
+    "配置响应缓存因容量淘汰的条目数",
+    "counter",
+    lambda: config_cache.evictions,
+)
+metrics.registry.callback(
+    "config_cache_bytes",
+    "配置响应缓存占用的字节数",
+    "gauge",
+    lambda: config_cache._total_bytes,
+)
@@ -0,0 +1,75 @@
+import os
+import threading
+
+from storage import file_signature, read_file_content
+
+DECOY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "err_return")
+DECOY_TYPES = ("qu", "modlist")
+
+
+class DecoyPayload:
+    """一份可直接发送的伪装响应（body / status / headers 均预先算好）"""
+
+    __slots__ = ("signature", "response")
+
+    def __init__(self, signature, response):
+        self.signature = signature
+        self.response = response
+
+
+def _build_payload(name, path):
+    signature = file_signature(path)
+    content, _, err = read_file_content(path)
+    if content:
+        headers = {"Content-Type": "application/json; charset=utf-8"}
+        return DecoyPayload(signature, (content.encode("utf-8"), 200, headers))
+    return DecoyPayload(signature, (f"{name}文件读取失败: " + (err or ""), 500))
+
+
+class DecoyStore:
+    """err_return/qu.txt、modlist.txt 的内存副本
+
+    create_app() 时加载一次，之后由后台线程检测文件变化并整体替换，
+    请求路径上只做一次字典查找，不接触磁盘。
+    """
+
+    def __init__(self, directory=DECOY_DIR):
+        self.directory = directory
+        self._payloads = {}
+        self._lock = threading.Lock()
+
+    def path_for(self, name):
+        return os.path.join(self.directory, f"{name}.txt")
+
+    def load(self):
+        """全部重新加载，构建好新字典后一次性替换"""
+        with self._lock:
+            self._payloads = {
+                name: _build_payload(name, self.path_for(name)) for name in DECOY_TYPES
+            }
+
+    def refresh(self):
+        """只重新加载签名发生变化的伪装文件，返回是否有更新"""
+        with self._lock:
+            current = self._payloads
+            changed = {}
+            for name in DECOY_TYPES:
+                path = self.path_for(name)
+                old = current.get(name)
+                if old is None or file_signature(path) != old.signature:
+                    changed[name] = _build_payload(name, path)
+            if changed:
+                self._payloads = {**current, **changed}
+            return bool(changed)
+
+    def response(self, type_):
+        """type为qu或找不到都返回qu，否则返回modlist"""
+        name = "qu" if type_ in (None, "qu") else "modlist"
+        payload = self._payloads.get(name)
+        if payload is None:
+            return f"{name}文件未加载", 500
+        return payload.response
+
+
+# 进程级单例
+decoy_store = DecoyStore()
@@ -0,0 +1,325 @@
+import json
+import time
+import logging
+import threading
+import urllib.error
+import urllib.request
+from urllib.parse import urlencode
+
+from flask import Blueprint, abort, request
+
+import metrics
+import profiling
+from cache import CachedPayload, config_cache, config_types
+from decoys import decoy_store
+from models import get_db_connection
+from views import send_cached_payload
+
+logger = logging.getLogger(__name__)
+
+edge_bp = Blueprint("edge", __name__)
+
+
+# ===========================
+# 本地存储
+# ===========================
+def init_edge_db():
+    """边缘节点的本地库：主节点同步来的配置及已同步到的序号（重复执行无副作用）"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(
+        """
+    CREATE TABLE IF NOT EXISTS edge_configs (
+        uuid            TEXT PRIMARY KEY,
+        type            TEXT NOT NULL,
+        content_version INTEGER NOT NULL,
+        sync_seq        INTEGER NOT NULL,
+        deleted         INTEGER NOT NULL DEFAULT 0,
+        body            BLOB  -- 与主节点 /api/config 返回的字节相同，文件不存在时为 NULL
+    )
+    """
+    )
+    c.execute(
+        """
+    CREATE TABLE IF NOT EXISTS edge_state (
+        id      INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL,
+        epoch   TEXT  -- 主库的同步纪元，变化时全量重新同步
+    )
+    """
+    )
+    c.execute("PRAGMA table_info(edge_state)")
+    if "epoch" not in {row["name"] for row in c.fetchall()}:
+        c.execute("ALTER TABLE edge_state ADD COLUMN epoch TEXT")
+    c.execute("INSERT OR IGNORE INTO edge_state (id, version) VALUES (1, 0)")
+    conn.commit()
+    conn.close()
+
+
+def stored_version():
+    """返回 (已同步到的序号, 主库纪元)"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("SELECT version, epoch FROM edge_state WHERE id = 1")
+    version, epoch = c.fetchone()
+    conn.close()
+    return version, epoch
+
+
+def reload_types():
+    """伪装响应按配置类型选择，类型索引改从本地库加载"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("SELECT uuid, type FROM edge_configs WHERE deleted = 0")
+    types = {row["uuid"]: row["type"] for row in c.fetchall()}
+    conn.close()
+    config_types.replace(types)
+
+
+_UPSERT_SQL = """
+    INSERT INTO edge_configs (uuid, type, content_version, sync_seq, deleted, body)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(uuid) DO UPDATE SET
+        type = excluded.type,
+        content_version = excluded.content_version,
+        sync_seq = excluded.sync_seq,
+        deleted = excluded.deleted,
+        body = excluded.body
+    WHERE excluded.sync_seq > edge_configs.sync_seq
+"""
+
+
+def _rows(configs):
+    return [
+        (
+            item["uuid"],
+            item["type"],
+            item["content_version"],
+            item["sync_seq"],
+            1 if item["deleted"] else 0,
+            item["content"].encode("utf-8")
+            if item["content"] is not None and not item["deleted"]
+            else None,
+        )
+        for item in configs
+    ]
+
+
+def apply_delta(configs, version, epoch):
+    """把一批增量写入本地库
+
+    按 sync_seq 条件覆盖：同一个库上有多个 worker 各自同步时，晚到的旧数据不会覆盖新数据。
+    已删除的配置保留为墓碑（deleted=1）以便比较序号。
+    """
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.executemany(_UPSERT_SQL, _rows(configs))
+        c.execute(
+            "UPDATE edge_state SET version = MAX(version, ?), epoch = ? WHERE id = 1",
+            (version, epoch),
+        )
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def replace_all(configs, version, epoch):
+    """全量同步：在一个事务里清空本地库并写入主节点的全部配置
+
+    主库被替换或回退后序号会重新开始，按序号条件覆盖和 MAX(version) 都会挡住新数据，
+    所以这里直接清空，版本也直接设置而不取较大值。
+    """
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute("BEGIN IMMEDIATE")
+        c.execute("DELETE FROM edge_configs")
+        c.executemany(_UPSERT_SQL, _rows(configs))
+        c.execute(
+            "UPDATE edge_state SET version = ?, epoch = ? WHERE id = 1", (version, epoch)
+        )
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def _load_payload(uuid):
+    """从本地库读取配置并写入缓存，配置不存在或主节点上文件缺失时返回 None"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("SELECT type, body FROM edge_configs WHERE uuid = ? AND deleted = 0", (uuid,))
+    row = c.fetchone()
+    conn.close()
+    if row is None or row["body"] is None:
+        return None
+    # 边缘节点没有文件路径和签名，以 uuid 作为缓存的 file_id，由同步线程按 uuid 失效
+    return CachedPayload(uuid, uuid, row["type"], None, None, bytes(row["body"]))
+
+
+# ===========================
+# 增量同步
+# ===========================
+class EdgeSync:
+    """后台线程：定期向主节点拉取 sync_seq 大于本地版本的配置，写入本地库并失效缓存
+
+    主节点不可用时继续用本地库提供服务，恢复后从上次的版本接着同步。
+    """
+
+    def __init__(self, primary_url=None, token=None, interval=2.0, batch=100, timeout=10.0):
+        self.primary_url = primary_url
+        self.token = token
+        self.interval = interval
+        self.batch = batch
+        self.timeout = timeout
+        self.version = 0
+        self.epoch = None
+        self.resyncs = 0
+        self.generation = 0  # 每应用一批增量加一，供加载缓存时检测并发修改
+        self.last_success = None
+        self.last_error = None
+        self.failures = 0
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return self
+        self.version, self.epoch = stored_version()
+        self._thread = threading.Thread(target=self._run, name="edge-sync", daemon=True)
+        self._thread.start()
+        return self
+
+    def _fetch(self, since):
+        query = urlencode({"since": since, "limit": self.batch})
+        req = urllib.request.Request(
+            f"{self.primary_url.rstrip('/')}/api/sync/configs?{query}",
+            headers={"X-Sync-Token": self.token or "", "Accept": "application/json"},
+        )
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            return json.loads(resp.read().decode("utf-8"))
+
+    def sync_once(self):
+        """拉取直到追上主节点，返回本次应用的配置数"""
+        applied = 0
+        while True:
+            delta = self._fetch(self.version)
+            if delta["current"] < self.version or (
+                self.epoch is not None and delta["epoch"] != self.epoch
+            ):
+                # 主库被替换（纪元变化）或回退（例如恢复了旧的 data.db），本地数据不可再用
+                logger.warning(
+                    "主节点同步纪元或序号变化（%s/%s -> %s/%s），重新全量同步",
+                    self.epoch,
+                    self.version,
+                    delta["epoch"],
+                    delta["current"],
+                )
+                return self.resync()
+            version = delta["version"]
+            configs = delta["configs"]
+            if configs or version != self.version or delta["epoch"] != self.epoch:
+                apply_delta(configs, version, delta["epoch"])
+                self.generation += 1
+                for item in configs:
+                    config_cache.invalidate_file(item["uuid"])
+                if configs:
+                    reload_types()
+                self.version = version
+                self.epoch = delta["epoch"]
+                applied += len(configs)
+            if not delta["more"]:
+                return applied
+
+    def resync(self):
+        """从序号 0 拉取全部配置，一次性替换本地库，返回配置数"""
+        configs = []
+        version = 0
+        epoch = None
+        while True:
+            delta = self._fetch(version)
+            if epoch is not None and delta["epoch"] != epoch:
+                # 拉取过程中主库又换了，从头再来
+                configs, version, epoch = [], 0, None
+                continue
+            epoch = delta["epoch"]
+            configs.extend(delta["configs"])
+            version = delta["version"]
+            if not delta["more"]:
+                break
+        replace_all(configs, version, epoch)
+        self.generation += 1
+        config_cache.clear()
+        reload_types()
+        self.version = version
+        self.epoch = epoch
+        self.resyncs += 1
+        return len(configs)
+
+    def _run(self):
+        while True:
+            try:
+                applied = self.sync_once()
+                self.last_success = time.time()
+                self.last_error = None
+                if applied:
+                    logger.info("已从主节点同步 %s 个配置，版本 %s", applied, self.version)
+            except (urllib.error.URLError, OSError, ValueError, KeyError) as e:
+                self.failures += 1
+                if self.last_error is None:
+                    logger.warning("同步主节点失败，继续使用本地数据: %s", e)
+                self.last_error = str(e)
+            except Exception:
+                self.failures += 1
+                logger.exception("同步主节点失败")
+            time.sleep(self.interval)
+
+
+# 进程级单例，APP_MODE=edge 时在 create_app() 中启动
+edge_sync = EdgeSync()
+
+metrics.registry.callback(
+    "edge_sync_version", "边缘节点已同步到的主节点序号", "gauge", lambda: edge_sync.version
+)
+metrics.registry.callback(
+    "edge_sync_resyncs_total", "边缘节点全量重新同步次数", "counter", lambda: edge_sync.resyncs
+)
+metrics.registry.callback(
+    "edge_sync_failures_total", "边缘节点同步失败次数", "counter", lambda: edge_sync.failures
+)
+
+
+# ===========================
+# 公共接口（边缘节点只提供这一个）
+# ===========================
+@edge_bp.route("/api/config/<string:file_id>", methods=["GET"])
+def public_get_config(file_id):
+    user_agent = request.headers.get("User-Agent", "")
+
+    # User-Agent 不符时返回 qu 或 modlist 伪装内容，与主节点一致
+    if not user_agent.startswith("Dalvik"):
+        metrics.set_outcome("decoy", "decoy")
+        return decoy_store.response(config_types.get(file_id))
+
+    outcome = "hit"
+    entry = config_cache.get(file_id)
+    profiling.mark("cache_lookup")
+    if entry is None:
+        outcome = "load"
+        generation = edge_sync.generation
+        entry = _load_payload(file_id)
+        profiling.mark("db_query")
+        if entry is None:
+            metrics.set_outcome("dalvik", "not_found")
+            abort(404)
+        config_cache.put(entry)
+        # 读取期间同步线程写入了新数据时，这份可能已过期，不留在缓存里
+        if edge_sync.generation != generation:
+            config_cache.invalidate_file(file_id)
+
+    return send_cached_payload(entry, outcome)
@@ -0,0 +1,189 @@
+import time
+import sqlite3
+import logging
+import threading
+
+import metrics
+from cache import config_cache, config_types
+from models import db_pool, get_db_connection
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeFeed:
+    """uuid -> content_version 的内存快照，以及等待版本变化的长轮询 / SSE 等待者
+
+    后台线程轮询 sync_sequence 的序号（config_files 的任何变化都会由触发器递增它，
+    其他表的写入不会引起重新加载），变化时重新读取各配置的内容版本，
+    并只唤醒版本有变化的 uuid 上的等待者。
+    本进程内的发布会调用 poke() 立即检查，不必等下一个轮询周期。
+
+    同时负责让每个 worker 的响应缓存跟上其他 worker 的写入：sync_seq 变化
+    （内容发布、改路径、改类型、删除）或记录消失的 uuid 会从本进程缓存中失效，
+    配置类型索引也随之整体替换。
+    """
+
+    def __init__(
+        self, poll_interval=0.5, max_wait=60, stream_seconds=300, keepalive=15, max_waiters=4
+    ):
+        self.poll_interval = poll_interval
+        self.max_wait = max_wait  # 长轮询单次最长挂起秒数
+        self.stream_seconds = stream_seconds  # 单条 SSE 连接最长保持秒数，到期由客户端重连
+        self.keepalive = keepalive  # SSE 空闲时发送注释行的间隔
+        self._versions = {}
+        self._seqs = {}  # uuid -> sync_seq
+        self.generation = 0  # 每次发现变化加一，供加载缓存时检测并发修改
+        self.seq = None  # 最近一次读到的 sync_sequence 序号
+        self.max_waiters = max_waiters  # 本进程同时挂起的长轮询 / SSE 连接上限
+        self.busy_retry = 5  # 超出上限时建议客户端再次请求的间隔秒数
+        self._conditions = {}  # uuid -> [threading.Condition, 等待者数]
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.waiters = 0
+        self.rejected = 0
+
+    def start(self):
+        if self._thread is not None:
+            return self
+        self._versions, self._seqs, _ = self._load_versions()
+        self._thread = threading.Thread(target=self._run, name="change-feed", daemon=True)
+        self._thread.start()
+        return self
+
+    def _load_versions(self):
+        conn = get_db_connection()
+        c = conn.cursor()
+        c.execute(
+            "SELECT uuid, type, content_version, sync_seq FROM config_files "
+            "WHERE delete_time IS NULL"
+        )
+        rows = c.fetchall()
+        conn.close()
+        versions = {row["uuid"]: row["content_version"] for row in rows}
+        seqs = {row["uuid"]: row["sync_seq"] for row in rows}
+        types = {row["uuid"]: row["type"] for row in rows}
+        return versions, seqs, types
+
+    def _run(self):
+        # 单独开一条不进连接池的连接，长期轮询不占用请求的连接
+        conn = sqlite3.connect(db_pool.path, timeout=db_pool.timeout, check_same_thread=False)
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            try:
+                # fetchall 让语句执行完毕：停在结果中间的语句会一直持有读事务，之后读到的都是旧快照
+                current = conn.execute("SELECT seq FROM sync_sequence WHERE id = 1").fetchall()[0][0]
+                if current != self.seq:
+                    self.seq = current
+                    self._apply(*self._load_versions())
+            except Exception:
+                logger.exception("检查配置版本变化失败")
+
+    def _apply(self, versions, seqs, types):
+        old_seqs, self._seqs = self._seqs, seqs
+        stale = {
+            uuid for uuid in old_seqs.keys() | seqs.keys() if old_seqs.get(uuid) != seqs.get(uuid)
+        }
+        # 两次轮询之间新增并删除的配置不在任何一次快照里，按缓存中的 uuid 补上
+        stale.update(uuid for uuid in config_cache.uuids() if uuid not in seqs)
+        if stale:
+            self.generation += 1
+            config_types.replace(types)
+            for uuid in stale:
+                config_cache.invalidate(uuid)
+
+        old, self._versions = self._versions, versions
+        changed = [
+            uuid for uuid in old.keys() | versions.keys() if old.get(uuid) != versions.get(uuid)
+        ]
+        with self._lock:
+            slots = [self._conditions.get(uuid) for uuid in changed]
+        for slot in slots:
+            if slot is not None:
+                with slot[0]:
+                    slot[0].notify_all()
+
+    def stats(self):
+        return {
+            "seq": self.seq,
+            "generation": self.generation,
+            "configs": len(self._versions),
+            "waiters": self.waiters,
+            "max_waiters": self.max_waiters,
+            "rejected": self.rejected,
+            "conditions": len(self._conditions),
+        }
+
+    def poke(self):
+        """本进程刚发布过内容，立即检查一次"""
+        self._wake.set()
+
+    def version(self, uuid):
+        return self._versions.get(uuid)
+
+    def acquire(self):
+        """占用一个等待名额，本进程挂起的连接已达 max_waiters 时返回 False
+
+        gthread worker 中每个挂起的连接占住一个线程，不加上限时等待者会占满线程池，
+        连普通请求也无法处理。拿不到名额的请求不挂起，立即返回当前状态，
+        由客户端 busy_retry 秒后再问（退化为只查版本号的短轮询，不返回 503）。
+        """
+        with self._lock:
+            if self.waiters >= self.max_waiters:
+                self.rejected += 1
+                return False
+            self.waiters += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.waiters -= 1
+
+    def wait(self, uuid, since, timeout):
+        """等到 uuid 的内容版本与 since 不同（通常是更新）或超时，返回当前版本（配置不存在时返回 None）
+
+        只为存在的配置创建 Condition，并在最后一个等待者离开时删除，
+        公开接口上随意构造的 uuid 不会在内存中留下记录。
+        """
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            if uuid not in self._versions:
+                return None
+            slot = self._conditions.get(uuid)
+            if slot is None:
+                slot = self._conditions[uuid] = [threading.Condition(), 0]
+            slot[1] += 1
+        condition = slot[0]
+        try:
+            with condition:
+                while True:
+                    version = self._versions.get(uuid)
+                    if version is None or version != since:
+                        return version
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return version
+                    condition.wait(remaining)
+        finally:
+            with self._lock:
+                slot[1] -= 1
+                if slot[1] == 0:
+                    del self._conditions[uuid]
+
+
+# 进程级单例，create_app() 中启动
+change_feed = ChangeFeed()
+
+metrics.registry.callback(
+    "change_feed_waiters",
+    "正在等待配置变化的长轮询 / SSE 连接数",
+    "gauge",
+    lambda: change_feed.waiters,
+)
+metrics.registry.callback(
+    "change_feed_rejected_total",
+    "等待名额已满、未挂起而立即返回的长轮询 / SSE 请求数",
+    "counter",
+    lambda: change_feed.rejected,
+)
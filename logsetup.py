@@ -0,0 +1,249 @@
+import os
+import sys
+import glob
+import json
+import time
+import queue
+import uuid
+import atexit
+import logging
+import threading
+from datetime import datetime, timedelta
+from logging.handlers import (
+    QueueHandler,
+    QueueListener,
+    TimedRotatingFileHandler,
+    WatchedFileHandler,
+)
+
+from flask import g, has_request_context, request, session
+
+import metrics
+
+# 是否允许在日志中附带配置内容片段（例如 JSON 解析出错位置附近的文本），默认关闭
+payload_excerpts = False
+
+SLOW_LOGGER = "slow_requests"
+LOG_FILES = ("logs/app.log", "logs/slow.log")
+BACKUP_COUNT = 30  # 保留30天的日志
+_listener = None
+_queue_handler = None
+
+
+class JsonFormatter(logging.Formatter):
+    """每条记录输出一行 JSON，extra={"fields": {...}} 中的字段平铺到顶层"""
+
+    def format(self, record):
+        data = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "pid": record.process,
+            "where": f"{record.module}:{record.lineno}",
+        }
+        context = getattr(record, "context", None)
+        if context:
+            data.update(context)
+        fields = getattr(record, "fields", None)
+        if fields:
+            data.update(fields)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exception"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def _session_user_id():
+    # 不用 session.get：它会把会话标记为已访问，给公共接口的响应加上 Vary: Cookie
+    return dict.get(session._get_current_object(), "user_id")
+
+
+class ContextQueueHandler(QueueHandler):
+    """在请求线程里只做两件事：附上请求上下文、非阻塞入队
+
+    格式化和写文件都在 QueueListener 的后台线程中完成。
+    队列满时直接丢弃并计数，不让日志拖慢请求。
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # 不调用父类 prepare（它会在请求线程里格式化整条消息）
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        if has_request_context():
+            context = {
+                "request_id": g.get("request_id"),
+                "user_id": _session_user_id(),
+                "route": request.endpoint,
+                "method": request.method,
+            }
+            started = g.get("_request_started")
+            if started is not None:
+                context["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 3)
+            record.context = context
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _NameFilter(logging.Filter):
+    """按 logger 名称把记录分给不同文件：only=True 只要该名称，否则排除该名称"""
+
+    def __init__(self, name, only):
+        super().__init__()
+        self.target = name
+        self.only = only
+
+    def filter(self, record):
+        return (record.name == self.target) == self.only
+
+
+def _file_handler(path, rotation):
+    if rotation == "timed":
+        handler = TimedRotatingFileHandler(
+            path,
+            when="midnight",  # 每天0点
+            interval=1,  # 间隔1天
+            backupCount=BACKUP_COUNT,
+            encoding="utf-8",
+        )
+    else:
+        # 多个进程写同一个文件时由外部统一改名，各进程发现文件被改名后重新打开
+        handler = WatchedFileHandler(path, encoding="utf-8")
+    handler.setFormatter(JsonFormatter())
+    return handler
+
+
+def setup_logging(
+    level="INFO", queue_size=10000, console=False, slow_log=False, rotation="timed"
+):
+    """根 logger 只挂一个 QueueHandler，后台线程负责写 logs/app.log（及 logs/slow.log）
+
+    rotation 为 timed 时本进程每天 0 点自行轮转（单进程运行）；
+    否则只写不轮转，由 gunicorn master（master）或 logrotate 等外部工具（external）轮转。
+    每个进程只初始化一次，重复调用直接返回。
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        return _queue_handler
+
+    os.makedirs("logs", exist_ok=True)
+    handlers = []
+
+    app_handler = _file_handler("logs/app.log", rotation)
+    app_handler.addFilter(_NameFilter(SLOW_LOGGER, only=False))
+    handlers.append(app_handler)
+
+    if slow_log:
+        slow_handler = _file_handler("logs/slow.log", rotation)
+        slow_handler.addFilter(_NameFilter(SLOW_LOGGER, only=True))
+        handlers.append(slow_handler)
+
+    if console:
+        stream_handler = logging.StreamHandler(sys.stderr)
+        stream_handler.setFormatter(JsonFormatter())
+        handlers.append(stream_handler)
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    _queue_handler = ContextQueueHandler(log_queue)
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    root = logging.getLogger()
+    root.addHandler(_queue_handler)
+    root.setLevel(level)
+    return _queue_handler
+
+
+# ===========================
+# 多进程部署的日志轮转（在 gunicorn master 中运行）
+# ===========================
+def rotate_logs(paths=LOG_FILES, backup_count=BACKUP_COUNT, day=None):
+    """把日志改名为 <文件名>.<日期>（与单进程的 TimedRotatingFileHandler 命名一致），并删除多余的旧文件
+
+    只由一个进程执行；各 worker 的 WatchedFileHandler 在下一次写入时发现文件已被改名，自动新建。
+    """
+    day = day or (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+    for path in paths:
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            target = f"{path}.{day}"
+            if os.path.exists(target):
+                # 同一天重复轮转（例如手动执行过）时追加序号，不覆盖已有文件
+                target = f"{target}.{int(time.time())}"
+            os.rename(path, target)
+        backups = sorted(glob.glob(f"{glob.escape(path)}.????-??-??*"))
+        for old in backups[:-backup_count] if backup_count > 0 else []:
+            os.remove(old)
+
+
+def start_log_rotator(paths=LOG_FILES, backup_count=BACKUP_COUNT):
+    """后台线程：每天 0 点调用 rotate_logs()"""
+
+    def loop():
+        while True:
+            tomorrow = datetime.now() + timedelta(days=1)
+            midnight = tomorrow.replace(hour=0, minute=0, second=0, microsecond=0)
+            # 分段睡眠，系统时间被调整时也能在 0 点附近醒来
+            while datetime.now() < midnight:
+                time.sleep(min(60, max(1, (midnight - datetime.now()).total_seconds())))
+            try:
+                day = (midnight - timedelta(days=1)).strftime("%Y-%m-%d")
+                rotate_logs(paths, backup_count, day)
+            except OSError as e:
+                sys.stderr.write(f"日志轮转失败: {e}\n")
+
+    thread = threading.Thread(target=loop, name="log-rotator", daemon=True)
+    thread.start()
+    return thread
+
+
+def dropped_records():
+    return _queue_handler.dropped if _queue_handler is not None else 0
+
+
+metrics.registry.callback(
+    "log_records_dropped_total", "日志队列已满而丢弃的记录数", "counter", dropped_records
+)
+
+
+# ===========================
+# 请求钩子（create_app 中注册）
+# ===========================
+def assign_request_id():
+    """沿用上游传来的 X-Request-ID，没有则生成一个"""
+    g.request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex[:16]
+    g._request_started = time.perf_counter()
+
+
+def finish_request(response):
+    response.headers["X-Request-ID"] = g.get("request_id", "")
+    access_logger = logging.getLogger("access")
+    # 访问记录为 DEBUG 级别，默认不输出，也不会进入队列
+    if access_logger.isEnabledFor(logging.DEBUG):
+        started = g.get("_request_started")
+        access_logger.debug(
+            "请求完成",
+            extra={
+                "fields": {
+                    "path": request.path,
+                    "status": response.status_code,
+                    "duration_ms": round((time.perf_counter() - started) * 1000, 3)
+                    if started is not None
+                    else None,
+                }
+            },
+        )
+    return response
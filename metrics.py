@@ -0,0 +1,421 @@
+import os
+import sys
+import glob
+import json
+import time
+import bisect
+import atexit
+import threading
+
+from flask import g, request
+
+# 请求 / 查询耗时的直方图分桶（秒）
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+# 线程分片数量超过该值时，把已退出线程的分片合并掉（开发服务器每个请求一个线程）
+MAX_THREAD_SHARDS = 64
+
+
+class _ThreadShards:
+    """按线程分片的计数数组
+
+    每个线程只写自己的分片，热路径上不加锁；只有线程第一次记录时加锁创建分片，
+    导出时把所有分片逐列相加。
+    """
+
+    def __init__(self, size):
+        self._size = size
+        self._shards = {}  # 线程 ident -> [计数...]
+        self._retired = [0] * size
+        self._lock = threading.Lock()
+
+    def local(self):
+        ident = threading.get_ident()
+        shard = self._shards.get(ident)
+        if shard is None:
+            with self._lock:
+                if len(self._shards) >= MAX_THREAD_SHARDS:
+                    self._retire_dead_locked()
+                shard = self._shards.setdefault(ident, [0] * self._size)
+        return shard
+
+    def _retire_dead_locked(self):
+        alive = {t.ident for t in threading.enumerate()}
+        for ident in [i for i in self._shards if i not in alive]:
+            for i, value in enumerate(self._shards.pop(ident)):
+                self._retired[i] += value
+
+    def total(self):
+        with self._lock:
+            shards = list(self._shards.values())
+            totals = list(self._retired)
+        for shard in shards:
+            for i, value in enumerate(shard):
+                totals[i] += value
+        return totals
+
+
+class Counter:
+    """只增不减的计数器，labels() 取得某组标签值对应的子计数器"""
+
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            yield self.name, dict(zip(self.labelnames, values)), child.total()[0]
+
+
+class _CounterChild:
+    __slots__ = ("_shards",)
+
+    def __init__(self):
+        self._shards = _ThreadShards(1)
+
+    def inc(self, amount=1):
+        self._shards.local()[0] += amount
+
+    def total(self):
+        return self._shards.total()
+
+
+class Histogram(Counter):
+    """固定分桶的直方图，导出 _bucket / _sum / _count"""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            labels = dict(zip(self.labelnames, values))
+            totals = child.total()
+            cumulative = 0
+            for bound, count in zip(self.buckets, totals):
+                cumulative += count
+                yield f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative
+            cumulative += totals[len(self.buckets)]
+            yield f"{self.name}_bucket", {**labels, "le": "+Inf"}, cumulative
+            yield f"{self.name}_sum", labels, totals[-1]
+            yield f"{self.name}_count", labels, cumulative
+
+
+class _HistogramChild:
+    __slots__ = ("_buckets", "_shards")
+
+    def __init__(self, buckets):
+        self._buckets = buckets
+        # 各分桶计数（不累加）+ 超出最大分桶的计数 + 总和
+        self._shards = _ThreadShards(len(buckets) + 2)
+
+    def observe(self, value):
+        shard = self._shards.local()
+        shard[bisect.bisect_left(self._buckets, value)] += 1
+        shard[-1] += value
+
+    def total(self):
+        return self._shards.total()
+
+
+class _Callback:
+    """导出时才取值的指标（连接池、缓存等已有的统计）"""
+
+    def __init__(self, name, documentation, type_, func):
+        self.name = name
+        self.documentation = documentation
+        self.type = type_
+        self.func = func
+
+    def samples(self):
+        value = self.func()
+        if isinstance(value, dict):
+            for labels, v in value.items():
+                yield self.name, dict(labels), v
+        else:
+            yield self.name, {}, value
+
+
+class MetricsRegistry:
+    """进程内指标注册表，按 Prometheus 文本格式导出
+
+    单进程时直接导出本进程的数据。多进程部署时（设置了 multiprocess_dir，gunicorn 下默认开启）
+    每个 worker 定期把自己的全部样本写成 <目录>/<pid>.json，导出时合并目录中的所有文件：
+    counter / histogram 按标签相加，包括已退出 worker 最后写下的数值，重启 worker 不会让计数倒退；
+    gauge 只取仍在运行的 worker，并加上 pid 标签逐个列出（各进程的连接池、队列长度等不宜相加）。
+    因此无论抓取请求落到哪个 worker，看到的都是整台机器的数据。
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self.multiprocess_dir = None
+        self._writer = None
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"指标 {metric.name} 已注册")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name, documentation, type_, func):
+        """注册导出时调用 func 取值的指标；func 可返回数值，或 {标签元组: 数值}"""
+        return self._register(_Callback(name, documentation, type_, func))
+
+    def _collect(self):
+        """本进程的全部样本：[(名称, 类型, 说明, [(样本名, 标签, 值), ...]), ...]"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return [
+            (metric.name, metric.type, metric.documentation, list(metric.samples()))
+            for metric in metrics
+        ]
+
+    # ===========================
+    # 多进程汇总
+    # ===========================
+    def start_multiprocess(self, directory, interval=5.0):
+        """在 worker 中调用：定期写出本进程快照，导出时合并目录中全部进程的数据"""
+        os.makedirs(directory, exist_ok=True)
+        self.multiprocess_dir = directory
+        path = os.path.join(directory, f"{os.getpid()}.json")
+        if os.path.exists(path):
+            # 之前用过同一 pid 的 worker 已退出，它的计数另存下来，不被本进程覆盖
+            os.replace(path, os.path.join(directory, f"retired-{os.getpid()}-{time.time_ns()}.json"))
+        self.write_snapshot()
+        atexit.register(self.write_snapshot)
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.write_snapshot()
+                except Exception:
+                    pass
+
+        self._writer = threading.Thread(target=loop, name="metrics-snapshot", daemon=True)
+        self._writer.start()
+
+    def write_snapshot(self):
+        pid = os.getpid()
+        data = {
+            "pid": pid,
+            "metrics": [
+                [name, type_, doc, [[n, list(labels.items()), v] for n, labels, v in samples]]
+                for name, type_, doc, samples in self._collect()
+            ],
+        }
+        path = os.path.join(self.multiprocess_dir, f"{pid}.json")
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def _merge(self):
+        merged = {}  # 名称 -> [类型, 说明, {(样本名, 标签元组): 值}]
+        for path in sorted(glob.glob(os.path.join(self.multiprocess_dir, "*.json"))):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            pid = data["pid"]
+            live = not os.path.basename(path).startswith("retired-") and _pid_alive(pid)
+            for name, type_, doc, samples in data["metrics"]:
+                metric = merged.setdefault(name, [type_, doc, {}])
+                values = metric[2]
+                if type_ in ("counter", "histogram"):
+                    for sample, labels, value in samples:
+                        key = (sample, tuple(map(tuple, labels)))
+                        values[key] = values.get(key, 0) + value
+                elif live:
+                    for sample, labels, value in samples:
+                        values[(sample, tuple(map(tuple, labels)) + (("pid", str(pid)),))] = value
+        return [
+            (name, type_, doc, [(sample, dict(labels), v) for (sample, labels), v in values.items()])
+            for name, (type_, doc, values) in merged.items()
+        ]
+
+    def render(self):
+        if self.multiprocess_dir is not None:
+            # 先写出本进程的最新数据，再合并
+            self.write_snapshot()
+            collected = self._merge()
+        else:
+            collected = self._collect()
+        lines = []
+        for name, type_, doc, samples in collected:
+            lines.append(f"# HELP {name} {doc}")
+            lines.append(f"# TYPE {name} {type_}")
+            for sample, labels, value in samples:
+                if labels:
+                    label_text = ",".join(
+                        f'{k}="{_escape(v)}"' for k, v in labels.items()
+                    )
+                    lines.append(f"{sample}{{{label_text}}} {_format_value(value)}")
+                else:
+                    lines.append(f"{sample} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _pid_alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def clear_multiprocess_dir(directory):
+    """master 启动时调用：清掉上一次运行留下的快照，计数从 0 开始"""
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, "*.json*")):
+        os.remove(path)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+# 进程级注册表与内置指标
+registry = MetricsRegistry()
+
+REQUEST_LATENCY = registry.histogram(
+    "http_request_duration_seconds",
+    "按路由统计的请求耗时",
+    ("endpoint", "method", "status"),
+)
+RESPONSE_BYTES = registry.counter(
+    "http_response_bytes_total",
+    "按路由和 Content-Encoding 统计的响应体字节数",
+    ("endpoint", "encoding"),
+)
+CONFIG_API_LATENCY = registry.histogram(
+    "config_api_request_duration_seconds",
+    "公共配置接口耗时，按 UA 类型（dalvik / decoy）和处理结果区分",
+    ("ua_class", "outcome"),
+)
+DB_QUERY_LATENCY = registry.histogram(
+    "sqlite_query_duration_seconds",
+    "SQLite 语句执行耗时，按调用位置（模块.函数）区分",
+    ("site",),
+)
+FILE_READ_LATENCY = registry.histogram(
+    "file_read_duration_seconds",
+    "配置 / 伪装文件的读盘耗时",
+    ("result",),
+)
+
+# code 对象 -> "模块.函数"，避免每次查询都拼字符串
+_site_names = {}
+
+
+def call_site(depth):
+    """返回调用栈上第 depth 层（相对调用者）的 "模块.函数" 名称"""
+    frame = sys._getframe(depth + 1)
+    code = frame.f_code
+    name = _site_names.get(code)
+    if name is None:
+        module = frame.f_globals.get("__name__", "?")
+        name = _site_names[code] = f"{module}.{code.co_name}"
+    return name
+
+
+def observe_query(site, seconds):
+    DB_QUERY_LATENCY.labels(site).observe(seconds)
+
+
+def observe_file_read(seconds, ok):
+    FILE_READ_LATENCY.labels("ok" if ok else "error").observe(seconds)
+
+
+def set_outcome(ua_class, outcome):
+    """公共配置接口在视图里标记本次请求的 UA 类型和处理结果"""
+    g._metrics_config = (ua_class, outcome)
+
+
+# ===========================
+# 请求钩子（create_app 中注册）
+# ===========================
+def start_request_timer():
+    g._metrics_started = time.perf_counter()
+
+
+def record_request(response):
+    started = g.pop("_metrics_started", None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    endpoint = request.endpoint or "unmatched"
+    REQUEST_LATENCY.labels(endpoint, request.method, str(response.status_code)).observe(
+        elapsed
+    )
+    config_labels = g.pop("_metrics_config", None)
+    if config_labels is not None:
+        CONFIG_API_LATENCY.labels(*config_labels).observe(elapsed)
+    if not response.is_streamed:
+        length = response.calculate_content_length()
+        if length:
+            RESPONSE_BYTES.labels(
+                endpoint, response.headers.get("Content-Encoding", "identity")
+            ).inc(length)
+    return response
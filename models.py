@@ -1,22 +1,246 @@
 import sqlite3
 import os
+import queue
+import threading
+import time
+from flask import g, has_app_context
 from werkzeug.security import generate_password_hash
 
+import metrics
+import profiling
+
 DB_PATH = "data.db"
 
 
+class TimedCursor(sqlite3.Cursor):
+    """记录每条语句执行耗时的游标，按调用位置归类到 sqlite_query_duration_seconds"""
+
+    def execute(self, sql, parameters=(), _depth=1):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.observe_query(metrics.call_site(_depth), elapsed)
+            profiling.add("sqlite", elapsed)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.observe_query(metrics.call_site(1), elapsed)
+            profiling.add("sqlite", elapsed)
+
+
+class PooledConnection(sqlite3.Connection):
+    """连接池中的连接：close() 不会真正关闭，而是归还给连接池
+
+    在请求（应用上下文）内获取的连接会在整个请求中复用，
+    由 teardown 统一归还，视图里的 conn.close() 此时不做任何事。
+    """
+
+    pool = None
+    request_bound = False
+    checked_out = False
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        # conn.execute 的调用位置在上一层
+        return self.cursor().execute(sql, parameters, _depth=2)
+
+    def close(self):
+        if self.pool is None:
+            super().close()
+        elif not self.request_bound:
+            self.pool.release(self)
+
+    def really_close(self):
+        super().close()
+
+
+class ConnectionPool:
+    """WAL 模式的 SQLite 连接池，记录连接数量与等待情况"""
+
+    def __init__(
+        self,
+        path=DB_PATH,
+        max_size=8,
+        timeout=10.0,
+        cache_size_kb=20000,
+        mmap_size=256 * 1024 * 1024,
+    ):
+        self.path = path
+        self.max_size = max_size
+        self.timeout = timeout
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self.created = 0
+        self.in_use = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.timeouts = 0
+
+    def configure(self, **options):
+        """调整连接池参数，已建立的连接全部丢弃后按新参数重建"""
+        self.close_all()
+        for key, value in options.items():
+            if value is not None:
+                setattr(self, key, value)
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.timeout,
+            check_same_thread=False,
+            factory=PooledConnection,
+        )
+        conn.row_factory = sqlite3.Row
+        # WAL 模式下读写互不阻塞；NORMAL 同步级别在 WAL 下仍能保证数据库一致
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kb)}")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.pool = self
+        return conn
+
+    def _check_fork(self):
+        # fork 出的子进程不能复用父进程的连接，直接丢弃重建
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._idle = queue.LifoQueue()
+                    self._pid = os.getpid()
+                    self.created = 0
+                    self.in_use = 0
+
+    def acquire(self):
+        self._check_fork()
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._lock:
+                if self.created < self.max_size:
+                    self.created += 1
+                    create = True
+                else:
+                    create = False
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self.created -= 1
+                    raise
+            else:
+                started = time.perf_counter()
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    self.timeouts += 1
+                    raise sqlite3.OperationalError("数据库连接池已耗尽")
+                finally:
+                    self.waits += 1
+                    self.wait_time += time.perf_counter() - started
+        conn.checked_out = True
+        with self._lock:
+            self.in_use += 1
+        return conn
+
+    def release(self, conn):
+        if not conn.checked_out:
+            return
+        conn.checked_out = False
+        # 未提交的事务直接回滚，避免把脏状态带给下一个使用者
+        if conn.in_transaction:
+            conn.rollback()
+        conn.request_bound = False
+        with self._lock:
+            self.in_use -= 1
+        self._idle.put(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.really_close()
+            with self._lock:
+                self.created -= 1
+
+    def stats(self):
+        return {
+            "max_size": self.max_size,
+            "created": self.created,
+            "in_use": self.in_use,
+            "idle": self._idle.qsize(),
+            "waits": self.waits,
+            "wait_seconds": round(self.wait_time, 6),
+            "timeouts": self.timeouts,
+        }
+
+
+# 进程级连接池
+db_pool = ConnectionPool()
+
+metrics.registry.callback(
+    "sqlite_pool_connections",
+    "连接池中的连接数",
+    "gauge",
+    lambda: {
+        (("state", "in_use"),): db_pool.in_use,
+        (("state", "idle"),): db_pool._idle.qsize(),
+    },
+)
+metrics.registry.callback(
+    "sqlite_pool_wait_seconds_total",
+    "等待空闲连接的累计秒数",
+    "counter",
+    lambda: db_pool.wait_time,
+)
+metrics.registry.callback(
+    "sqlite_pool_timeouts_total", "获取连接超时次数", "counter", lambda: db_pool.timeouts
+)
+
+
 def get_db_connection():
-    """获取数据库连接（行工厂返回 dict 格式）"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """获取数据库连接（行工厂返回 dict 格式）
 
+    请求内多次调用返回同一个连接，请求结束时由 close_request_connection 归还。
+    """
+    if has_app_context():
+        conn = g.get("_db_conn")
+        if conn is None:
+            conn = db_pool.acquire()
+            conn.request_bound = True
+            g._db_conn = conn
+        return conn
+    return db_pool.acquire()
 
-def init_db():
-    """初始化数据库，创建表和触发器"""
-    conn = get_db_connection()
-    c = conn.cursor()
 
+def close_request_connection(exc=None):
+    """teardown_appcontext 回调：把请求内使用的连接归还连接池"""
+    conn = g.pop("_db_conn", None)
+    if conn is not None:
+        db_pool.release(conn)
+
+
+# ===========================
+# 数据库迁移
+# 按 PRAGMA user_version 记录已执行到第几个迁移，启动时只执行尚未执行的部分。
+# 迁移只能追加，不能修改已发布的迁移。
+# ===========================
+def _migration_001_base_schema(c):
+    """基础表结构、触发器、字段注释和默认管理员（旧库上重复执行无副作用）"""
     # 创建 users 表
     c.execute(
         """
@@ -136,5 +360,218 @@ CREATE TABLE IF NOT EXISTS user_config_permissions (
             ("admin", generate_password_hash("admin123"), 1),
         )
 
-    conn.commit()
-    conn.close()
+
+def _migration_002_encoding_columns(c):
+    """config_files 增加编码探测结果字段"""
+    c.execute("PRAGMA table_info(config_files)")
+    columns = {row["name"] for row in c.fetchall()}
+    for column in ("encoding", "encoding_signature"):
+        if column not in columns:
+            c.execute(f"ALTER TABLE config_files ADD COLUMN {column} TEXT")
+    c.executemany(
+        "INSERT OR IGNORE INTO column_comments (table_name, column_name, comment) VALUES (?, ?, ?)",
+        [
+            ("config_files", "encoding", "文件编码"),
+            ("config_files", "encoding_signature", "探测编码时的文件签名 mtime_ns:size:inode"),
+        ],
+    )
+
+
+def _migration_003_indexes(c):
+    """权限表去重并加唯一索引，有效配置加部分索引"""
+    # 旧数据里可能有重复授权，保留最早的一条
+    c.execute(
+        """
+    DELETE FROM user_config_permissions
+    WHERE id NOT IN (
+        SELECT MIN(id) FROM user_config_permissions
+        GROUP BY user_id, config_file_id
+    )
+    """
+    )
+    c.execute(
+        """
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_ucp_user_config
+    ON user_config_permissions (user_id, config_file_id)
+    """
+    )
+    c.execute(
+        """
+    CREATE INDEX IF NOT EXISTS idx_ucp_config
+    ON user_config_permissions (config_file_id)
+    """
+    )
+    # 只索引未删除的配置，列表按 id 倒序扫描时跳过已删除行；
+    # uuid 列本身带 UNIQUE 自动索引，公共接口查询不需要再加
+    c.execute(
+        """
+    CREATE INDEX IF NOT EXISTS idx_config_files_active_id
+    ON config_files (id) WHERE delete_time IS NULL
+    """
+    )
+    c.execute("ANALYZE")
+
+
+def _migration_004_list_sort_indexes(c):
+    """配置列表各排序列的 (列, id) 部分索引，支撑键集分页"""
+    for column in ("type", "name", "version", "created_time", "updated_time"):
+        c.execute(
+            f"""
+        CREATE INDEX IF NOT EXISTS idx_config_files_active_{column}
+        ON config_files ({column}, id) WHERE delete_time IS NULL
+        """
+        )
+    c.execute("ANALYZE")
+
+
+def _migration_005_content_version(c):
+    """config_files 增加内容版本号，每次发布内容递增"""
+    c.execute("PRAGMA table_info(config_files)")
+    columns = {row["name"] for row in c.fetchall()}
+    if "content_version" not in columns:
+        c.execute(
+            "ALTER TABLE config_files ADD COLUMN content_version INTEGER NOT NULL DEFAULT 1"
+        )
+    c.execute(
+        "INSERT OR IGNORE INTO column_comments (table_name, column_name, comment) VALUES (?, ?, ?)",
+        ("config_files", "content_version", "内容版本号，每次发布递增"),
+    )
+
+
+def _migration_006_file_events(c):
+    """记录在界面之外对配置文件的修改（由文件监控发现）"""
+    c.execute(
+        """
+    CREATE TABLE IF NOT EXISTS config_file_events (
+        id             INTEGER PRIMARY KEY AUTOINCREMENT,
+        config_file_id INTEGER NOT NULL,
+        path           TEXT NOT NULL,
+        event          TEXT NOT NULL,  -- modified 或 deleted
+        signature      TEXT,           -- 修改后的文件签名 mtime_ns:size:inode
+        created_time   TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(config_file_id) REFERENCES config_files(id)
+    )
+    """
+    )
+    c.execute(
+        """
+    CREATE INDEX IF NOT EXISTS idx_config_file_events_file
+    ON config_file_events (config_file_id, id)
+    """
+    )
+
+
+def _migration_007_authz_version(c):
+    """授权版本号：修改用户权限时递增，各进程据此刷新内存中的授权索引"""
+    c.execute(
+        """
+    CREATE TABLE IF NOT EXISTS authz_version (
+        id      INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    )
+    """
+    )
+    c.execute("INSERT OR IGNORE INTO authz_version (id, version) VALUES (1, 1)")
+
+
+def _migration_008_sync_sequence(c):
+    """全局同步序号：config_files 的元数据或内容版本变化时分配新序号，供只读边缘节点增量同步"""
+    c.execute(
+        """
+    CREATE TABLE IF NOT EXISTS sync_sequence (
+        id  INTEGER PRIMARY KEY CHECK (id = 1),
+        seq INTEGER NOT NULL
+    )
+    """
+    )
+    c.execute("PRAGMA table_info(config_files)")
+    columns = {row["name"] for row in c.fetchall()}
+    if "sync_seq" not in columns:
+        c.execute("ALTER TABLE config_files ADD COLUMN sync_seq INTEGER NOT NULL DEFAULT 0")
+    # 已有记录按 id 编号，序号从当前最大 id 继续。
+    # 回填期间暂时去掉 updated_time 触发器，否则所有记录的更新时间都会被改成迁移时刻
+    c.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'trigger' "
+        "AND name = 'set_config_files_updated_time'"
+    )
+    trigger = c.fetchone()
+    if trigger is not None:
+        c.execute("DROP TRIGGER set_config_files_updated_time")
+    c.execute("UPDATE config_files SET sync_seq = id")
+    if trigger is not None:
+        c.execute(trigger[0])
+    c.execute(
+        "INSERT OR IGNORE INTO sync_sequence (id, seq) "
+        "SELECT 1, COALESCE(MAX(id), 0) FROM config_files"
+    )
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS idx_config_files_sync_seq ON config_files (sync_seq)"
+    )
+    # 由触发器分配序号，所有写入路径（界面、批量修改、文件监控）都不会遗漏；
+    # 只改编码探测结果（encoding / encoding_signature）不影响对外内容，不分配
+    for event, name in (
+        ("INSERT", "insert"),
+        ("UPDATE OF uuid, type, path, content_version, delete_time", "update"),
+    ):
+        c.execute(
+            f"""
+        CREATE TRIGGER IF NOT EXISTS config_files_sync_{name}
+        AFTER {event} ON config_files
+        FOR EACH ROW
+        BEGIN
+            UPDATE sync_sequence SET seq = seq + 1 WHERE id = 1;
+            UPDATE config_files
+            SET sync_seq = (SELECT seq FROM sync_sequence WHERE id = 1)
+            WHERE id = NEW.id;
+        END;
+        """
+        )
+    c.execute(
+        "INSERT OR IGNORE INTO column_comments (table_name, column_name, comment) VALUES (?, ?, ?)",
+        ("config_files", "sync_seq", "全局同步序号，元数据或内容变化时递增"),
+    )
+
+
+def _migration_009_sync_epoch(c):
+    """同步纪元：每个主库生成一次的随机标识，边缘节点发现它变化（换了库）时全量重新同步"""
+    c.execute("PRAGMA table_info(sync_sequence)")
+    columns = {row["name"] for row in c.fetchall()}
+    if "epoch" not in columns:
+        c.execute("ALTER TABLE sync_sequence ADD COLUMN epoch TEXT")
+    c.execute("UPDATE sync_sequence SET epoch = lower(hex(randomblob(16))) WHERE epoch IS NULL")
+
+
+MIGRATIONS = [
+    _migration_001_base_schema,
+    _migration_002_encoding_columns,
+    _migration_003_indexes,
+    _migration_004_list_sort_indexes,
+    _migration_005_content_version,
+    _migration_006_file_events,
+    _migration_007_authz_version,
+    _migration_008_sync_sequence,
+    _migration_009_sync_epoch,
+]
+
+
+def init_db():
+    """初始化数据库：依次执行尚未执行过的迁移"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        for number, migration in enumerate(MIGRATIONS, start=1):
+            # 每个迁移单独一个事务，多个进程同时启动时由写锁串行化
+            c.execute("BEGIN IMMEDIATE")
+            try:
+                c.execute("PRAGMA user_version")
+                if c.fetchone()[0] >= number:
+                    c.execute("ROLLBACK")
+                    continue
+                migration(c)
+                c.execute(f"PRAGMA user_version = {number}")
+                c.execute("COMMIT")
+            except Exception:
+                c.execute("ROLLBACK")
+                raise
+    finally:
+        conn.close()
@@ -0,0 +1,159 @@
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+import metrics
+
+
+class HashPoolBusy(Exception):
+    """密码哈希线程池已满，请求应立即拒绝而不是排队等待"""
+
+
+class HashPool:
+    """专用于密码哈希的有界线程池
+
+    同时在执行和排队的任务不超过 workers + queue_limit 个，超出时直接抛出 HashPoolBusy；
+    这样大量登录请求最多占住这么多个请求线程（每个最多 timeout 秒），其余线程仍可处理 /api/config。
+    两者之和应明显小于 worker 的请求线程数，create_app 中按 WEB_THREADS 计算默认值。
+    """
+
+    def __init__(self, workers=2, queue_limit=0, timeout=3.0):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+        self._count_lock = threading.Lock()
+        self.in_flight = 0
+        self.rejected = 0
+
+    def configure(self, workers=None, queue_limit=None, timeout=None):
+        with self._lock:
+            if workers is not None:
+                self.workers = workers
+            if queue_limit is not None:
+                self.queue_limit = queue_limit
+            if timeout is not None:
+                self.timeout = timeout
+            old, self._executor, self._slots = self._executor, None, None
+        if old is not None:
+            old.shutdown(wait=False)
+
+    def _ensure(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._slots = threading.BoundedSemaphore(self.workers + self.queue_limit)
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.workers, thread_name_prefix="password-hash"
+                    )
+        return self._executor, self._slots
+
+    def run(self, func, *args):
+        """在线程池中执行 func(*args) 并等待结果；池满时立即抛出 HashPoolBusy"""
+        executor, slots = self._ensure()
+        if not slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HashPoolBusy()
+        self._track(1)
+
+        def task():
+            try:
+                return func(*args)
+            finally:
+                self._track(-1)
+                slots.release()
+
+        try:
+            future = executor.submit(task)
+        except BaseException:
+            self._track(-1)
+            slots.release()
+            raise
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            # 还在排队的任务被取消后不会再执行，名额在这里归还；已在执行的由任务结束时归还
+            if future.cancel():
+                self._track(-1)
+                slots.release()
+            raise HashPoolBusy()
+
+    def _track(self, delta):
+        with self._count_lock:
+            self.in_flight += delta
+
+    def check(self, pwhash, password):
+        return self.run(check_password_hash, pwhash, password)
+
+    def generate(self, password):
+        return self.run(generate_password_hash, password)
+
+
+class FailureThrottle:
+    """按键（用户名 / IP）统计登录失败次数的固定窗口限流
+
+    每个键只保存 [失败次数, 窗口开始时间]，条目数超过 max_entries 时淘汰最久未更新的键。
+    """
+
+    def __init__(self, limit, window, max_entries=10000):
+        self.limit = limit
+        self.window = window
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def retry_after(self, key):
+        """被限制时返回还需等待的秒数，否则返回 0"""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < self.limit:
+            return 0
+        remaining = entry[1] + self.window - time.monotonic()
+        return max(0, int(remaining) + 1) if remaining > 0 else 0
+
+    def fail(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or now - entry[1] > self.window:
+                entry = [0, now]
+            entry[0] += 1
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def reset(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# 进程级单例，create_app 中按 .env 调整参数
+hash_pool = HashPool()
+user_throttle = FailureThrottle(limit=5, window=300)
+ip_throttle = FailureThrottle(limit=20, window=300)
+
+LOGIN_ATTEMPTS = metrics.registry.counter(
+    "login_attempts_total",
+    "登录 / 修改密码的校验结果（ok、failed、throttled、overloaded）",
+    ("route", "result"),
+)
+metrics.registry.callback(
+    "password_hash_in_flight",
+    "密码哈希线程池中执行和排队的任务数",
+    "gauge",
+    lambda: hash_pool.in_flight,
+)
+metrics.registry.callback(
+    "password_hash_rejected_total",
+    "因哈希线程池已满而立即拒绝的请求数",
+    "counter",
+    lambda: hash_pool.rejected,
+)
@@ -0,0 +1,296 @@
+import io
+import os
+import glob
+import json
+import time
+import uuid
+import random
+import logging
+import marshal
+import pstats
+import cProfile
+import threading
+from datetime import datetime
+
+from flask import g, has_request_context, request
+
+# 分阶段计时开关与慢请求阈值，create_app 中按 .env 设置
+enabled = False
+slow_threshold_ms = 500.0
+
+slow_logger = logging.getLogger("slow_requests")
+
+
+def mark(name):
+    """记录从上一个 mark（或请求开始）到现在的耗时，计入阶段 name"""
+    if not enabled or not has_request_context():
+        return
+    timer = g.get("_profile")
+    if timer is None:
+        return
+    now = time.perf_counter()
+    timer["phases"].append((name, now - timer["last"]))
+    timer["last"] = now
+
+
+def add(component, seconds):
+    """累加底层操作（SQLite、读盘、编码探测、JSON）的耗时和次数，可与阶段重叠"""
+    if not enabled or not has_request_context():
+        return
+    timer = g.get("_profile")
+    if timer is None:
+        return
+    total, count = timer["components"].get(component, (0.0, 0))
+    timer["components"][component] = (total + seconds, count + 1)
+
+
+class RouteProfiler:
+    """按路由抽样采集 cProfile，管理员运行时开关，结果累加后可下载
+
+    开关状态和采集结果都放在共享目录（directory，默认 run/profile）中，对所有 worker 生效：
+      state.json               当前采集设置，每次开始时生成新的 session
+      <session>.<pid>.prof     每个 worker 累计的 pstats 结果
+      <session>.<pid>.count    每个 worker 已采集的样本数
+    worker 最多每秒检查一次 state.json 是否变化；下载时合并所有 worker 的结果。
+    每次采集后汇总各 worker 的样本数，达到 max_samples 即停止；同时在采集中的请求可能使总数略超。
+    cProfile 同一时间只能有一个在采集，抽中的请求拿不到锁时直接跳过。
+    """
+
+    REFRESH_INTERVAL = 1.0
+
+    def __init__(self, directory=os.path.join("run", "profile")):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._running = threading.Lock()
+        self.endpoint = None
+        self.sample_rate = 0.0
+        self.max_samples = 0
+        self.session = None
+        self.started_at = None
+        self.samples = 0  # 本进程本次 session 的样本数
+        self._stats = None
+        self._state_mtime = None
+        self._checked = 0.0
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _write_atomic(self, name, data):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(name)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _write_state(self, state):
+        self._write_atomic("state.json", json.dumps(state).encode("utf-8"))
+        self._refresh(force=True)
+
+    def _read_state(self):
+        try:
+            with open(self._path("state.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _refresh(self, force=False):
+        """state.json 变化时重新加载设置；开始了新的 session 时丢弃本进程的旧结果"""
+        now = time.monotonic()
+        if not force and now - self._checked < self.REFRESH_INTERVAL:
+            return
+        self._checked = now
+        try:
+            mtime = os.stat(self._path("state.json")).st_mtime_ns
+        except OSError:
+            mtime = None
+        if not force and mtime == self._state_mtime:
+            if self.endpoint is not None and self.total_samples() >= self.max_samples:
+                self.endpoint = None
+            return
+        self._state_mtime = mtime
+        state = self._read_state()
+        with self._lock:
+            if state.get("session") != self.session:
+                self.session = state.get("session")
+                self.samples = 0
+                self._stats = None
+            self.sample_rate = state.get("sample_rate", 0.0)
+            self.max_samples = state.get("max_samples", 0)
+            self.started_at = state.get("started_at")
+            self.endpoint = state.get("endpoint")
+        if self.endpoint is not None and self.total_samples() >= self.max_samples:
+            self.endpoint = None
+
+    def _session_files(self, suffix):
+        if self.session is None:
+            return []
+        return sorted(glob.glob(self._path(f"{self.session}.*.{suffix}")))
+
+    def total_samples(self):
+        """所有 worker 在本次 session 中已采集的样本数"""
+        total = 0
+        for path in self._session_files("count"):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    total += int(f.read() or 0)
+            except (OSError, ValueError):
+                continue
+        return total
+
+    def start(self, endpoint, sample_rate, max_samples):
+        # 清掉上一次 session 的结果
+        for path in glob.glob(self._path("*.prof")) + glob.glob(self._path("*.count")):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._write_state(
+            {
+                "session": uuid.uuid4().hex,
+                "endpoint": endpoint,
+                "sample_rate": sample_rate,
+                "max_samples": max_samples,
+                "started_at": datetime.now().isoformat(timespec="seconds"),
+            }
+        )
+
+    def stop(self):
+        state = self._read_state()
+        if state:
+            state["endpoint"] = None
+            self._write_state(state)
+
+    def maybe_begin(self, endpoint):
+        """请求开始时调用：命中抽样则返回已启用的 Profile，否则返回 None"""
+        if endpoint is None:
+            return None
+        self._refresh()
+        if endpoint != self.endpoint:
+            return None
+        if self.samples >= self.max_samples or random.random() >= self.sample_rate:
+            return None
+        if not self._running.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def finish(self, profile):
+        profile.disable()
+        self._running.release()
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profile)
+            else:
+                self._stats.add(profile)
+            self.samples += 1
+            if self.samples >= self.max_samples:
+                self.endpoint = None
+            session, samples, data = self.session, self.samples, marshal.dumps(self._stats.stats)
+        if session is None:
+            return
+        pid = os.getpid()
+        try:
+            self._write_atomic(f"{session}.{pid}.prof", data)
+            self._write_atomic(f"{session}.{pid}.count", str(samples).encode("ascii"))
+        except OSError:
+            logging.getLogger(__name__).exception("写入 cProfile 结果失败")
+        # 只有抽中的请求才走到这里，每次汇总一遍各 worker 的样本数代价不大
+        if self.total_samples() >= self.max_samples:
+            self.endpoint = None
+
+    def _merged(self):
+        self._refresh(force=True)
+        stats = None
+        for path in self._session_files("prof"):
+            try:
+                if stats is None:
+                    stats = pstats.Stats(path)
+                else:
+                    stats.add(path)
+            except (OSError, ValueError, EOFError, TypeError):
+                continue
+        return stats
+
+    def dump(self):
+        """返回 pstats 可直接加载的二进制内容（与 Stats.dump_stats 相同格式），合并全部 worker"""
+        stats = self._merged()
+        if stats is None:
+            return None
+        return marshal.dumps(stats.stats)
+
+    def report(self, sort="cumulative", limit=50):
+        stats = self._merged()
+        if stats is None:
+            return None
+        out = io.StringIO()
+        stats.stream = out
+        stats.sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def status(self):
+        self._refresh(force=True)
+        return {
+            "endpoint": self.endpoint,
+            "sample_rate": self.sample_rate,
+            "max_samples": self.max_samples,
+            "samples": self.total_samples(),
+            "started_at": self.started_at,
+            "has_stats": bool(self._session_files("prof")),
+        }
+
+
+# 进程级单例
+route_profiler = RouteProfiler()
+
+
+# ===========================
+# 请求钩子（create_app 中注册）
+# ===========================
+def begin_request():
+    profile = route_profiler.maybe_begin(request.endpoint)
+    if profile is not None:
+        g._cprofile = profile
+    if enabled:
+        now = time.perf_counter()
+        g._profile = {"start": now, "last": now, "phases": [], "components": {}}
+
+
+def end_request(response):
+    timer = g.pop("_profile", None)
+    if timer is None:
+        return response
+    elapsed_ms = (time.perf_counter() - timer["start"]) * 1000
+    if elapsed_ms < slow_threshold_ms:
+        return response
+
+    phases = {}
+    for name, seconds in timer["phases"]:
+        phases[name] = round(phases.get(name, 0.0) + seconds * 1000, 3)
+    # 最后一个 mark 之后到响应返回的时间
+    phases["respond"] = round((time.perf_counter() - timer["last"]) * 1000, 3)
+    components = {
+        name: {"ms": round(total * 1000, 3), "count": count}
+        for name, (total, count) in timer["components"].items()
+    }
+    slow_logger.warning(
+        "慢请求",
+        extra={
+            "fields": {
+                "path": request.path,
+                "status": response.status_code,
+                "duration_ms": round(elapsed_ms, 3),
+                "phases": phases,
+                "components": components,
+            }
+        },
+    )
+    return response
+
+
+def teardown_request(exc=None):
+    # 放在 teardown 中：视图抛出异常时也能停止采集并释放锁
+    profile = g.pop("_cprofile", None)
+    if profile is not None:
+        route_profiler.finish(profile)
@@ -0,0 +1,282 @@
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import profiling
+from cache import config_cache
+from feed import change_feed
+from models import get_db_connection
+from storage import (
+    atomic_write,
+    commit_temp,
+    decode_content,
+    discard_temp,
+    file_signature,
+    format_signature,
+    write_temp,
+)
+
+
+def bulk_workers():
+    """批量发布时并行读取、校验、写临时文件的线程数
+
+    每次创建线程池时读取，.env 在 create_app() 中才加载，导入时读取会拿不到。
+    """
+    return int(os.getenv("BULK_WORKERS", 8))
+
+
+class VersionConflict(Exception):
+    """保存时内容版本与编辑开始时不一致（期间有其他人保存过）"""
+
+    def __init__(self, current_version):
+        super().__init__(f"配置已被其他人修改（当前版本 {current_version}）")
+        self.current_version = current_version
+
+
+def serialize_config(config_data):
+    """与原来 json.dump(..., ensure_ascii=False, indent=4) 的输出保持一致"""
+    started = time.perf_counter()
+    data = json.dumps(config_data, ensure_ascii=False, indent=4).encode("utf-8")
+    profiling.add("json_serialize", time.perf_counter() - started)
+    return data
+
+
+def publish_config(file_id, config_data, expected_version=None):
+    """发布配置内容，返回新的内容版本号
+
+    写临时文件、fsync、rename 覆盖，并在同一个数据库写事务里递增 content_version。
+    写事务同时充当发布锁：并发保存按顺序执行，expected_version 不符时抛出 VersionConflict。
+    """
+    data = serialize_config(config_data)
+
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        c.execute(
+            "SELECT path, content_version FROM config_files WHERE id=? AND delete_time IS NULL",
+            (file_id,),
+        )
+        row = c.fetchone()
+        if not row:
+            raise FileNotFoundError("配置文件不存在")
+        current_version = row["content_version"]
+        if expected_version is not None and current_version != expected_version:
+            raise VersionConflict(current_version)
+
+        atomic_write(row["path"], data)
+        new_version = current_version + 1
+        # 内容由我们写成 utf-8，顺便记录编码，读取时无需再探测
+        c.execute(
+            """
+            UPDATE config_files
+            SET content_version=?, encoding='utf-8', encoding_signature=?
+            WHERE id=?
+            """,
+            (new_version, format_signature(file_signature(row["path"])), file_id),
+        )
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+        config_cache.invalidate_file(file_id)
+    change_feed.poke()
+    return new_version
+
+
+def record_external_change(file_id, path, signature, encoding):
+    """记录一次在界面之外发生的文件修改：递增内容版本并写入 config_file_events
+
+    以 encoding_signature 作为条件更新，多个进程同时发现同一次修改时只有一个会记录。
+    signature 为 None 表示文件被删除。返回是否由本次调用记录。
+    旧数据没有记录过签名时只补写编码和签名，不算作修改。
+    """
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        recorded = _record_external_change(c, file_id, path, signature, encoding)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    if recorded:
+        config_cache.invalidate_file(file_id)
+        change_feed.poke()
+    return recorded
+
+
+def _record_external_change(c, file_id, path, signature, encoding):
+    """record_external_change 的数据库部分，在调用方的事务中执行，不提交"""
+    event = "deleted" if signature is None else "modified"
+    # 删除也记成一个签名，文件之后被重新创建时仍能识别为修改
+    signature_text = format_signature(signature) or event
+    c.execute(
+        """
+        UPDATE config_files SET encoding=?, encoding_signature=?
+        WHERE id=? AND encoding_signature IS NULL
+        """,
+        (encoding, signature_text, file_id),
+    )
+    if c.rowcount > 0:
+        return False
+    c.execute(
+        """
+        UPDATE config_files
+        SET content_version = content_version + 1, encoding=?, encoding_signature=?
+        WHERE id=? AND encoding_signature IS NOT ?
+        """,
+        (encoding, signature_text, file_id, signature_text),
+    )
+    if c.rowcount == 0:
+        return False
+    c.execute(
+        """
+        INSERT INTO config_file_events (config_file_id, path, event, signature)
+        VALUES (?, ?, ?, ?)
+        """,
+        (file_id, path, event, format_signature(signature)),
+    )
+    return True
+
+
+class BulkResult:
+    """批量发布中单个文件的结果"""
+
+    __slots__ = ("file_id", "name", "ok", "message", "content_version")
+
+    def __init__(self, file_id, name):
+        self.file_id = file_id
+        self.name = name
+        self.ok = False
+        self.message = ""
+        self.content_version = None
+
+
+def _prepare(row, transform):
+    """工作线程：读取原文、应用修改、序列化并写好临时文件（不触碰数据库）
+
+    原文只读一次，恢复用的字节和修改的内容出自同一份；
+    文件签名与记录不一致时返回 (签名, 编码)，由调用方在事务中记为一次外部修改。
+    """
+    path = row["path"]
+    signature = file_signature(path)
+    changed = row["encoding_signature"] != format_signature(signature)
+    with open(path, "rb") as f:
+        original = f.read()
+    content, encoding = decode_content(original, None if changed else row["encoding"])
+    if content.startswith("\ufeff"):
+        content = content[1:]
+    config_data = json.loads(content)
+    message = transform(config_data) or "已修改"
+    external = (signature, encoding) if changed else None
+    return original, write_temp(path, serialize_config(config_data)), message, external
+
+
+def publish_many(file_ids, transform):
+    """在一个事务里把同一组修改发布到多个配置文件，全部成功或全部回滚
+
+    transform(config_data) 原地修改解析后的配置并返回一句结果说明，抛异常表示该文件失败。
+    读取、修改、写临时文件在线程池中并行执行；任何一个文件失败都不会替换任何文件。
+    替换阶段如果中途出错，已替换的文件用内存中的原文恢复。
+    返回 (是否全部成功, [BulkResult])。
+    """
+    if not file_ids:
+        return False, []
+
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("BEGIN IMMEDIATE")
+    prepared = {}
+    try:
+        placeholders = ",".join("?" * len(file_ids))
+        c.execute(
+            f"""
+            SELECT id, name, path, encoding, encoding_signature, content_version
+            FROM config_files WHERE id IN ({placeholders}) AND delete_time IS NULL
+            ORDER BY id
+            """,
+            list(file_ids),
+        )
+        rows = c.fetchall()
+        results = {row["id"]: BulkResult(row["id"], row["name"]) for row in rows}
+        ok = True
+        for file_id in file_ids:
+            if file_id not in results:
+                results[file_id] = BulkResult(file_id, "")
+                results[file_id].message = "失败: 配置文件不存在"
+                ok = False
+
+        with ThreadPoolExecutor(max_workers=max(1, min(bulk_workers(), len(rows)))) as pool:
+            futures = {row["id"]: pool.submit(_prepare, row, transform) for row in rows}
+            for file_id, future in futures.items():
+                try:
+                    prepared[file_id] = future.result()
+                    results[file_id].message = prepared[file_id][2]
+                except Exception as e:
+                    results[file_id].message = f"失败: {e}"
+                    ok = False
+
+        if not ok:
+            for file_id, (_, tmp_path, _, _) in prepared.items():
+                discard_temp(tmp_path)
+                results[file_id].message = "未保存（其他文件失败，已全部回滚）"
+            conn.rollback()
+            return False, list(results.values())
+
+        # 上次记录之后在界面之外改过的文件，先记一次外部修改（修改已基于磁盘上的新内容）
+        rows_by_id = {row["id"]: row for row in rows}
+        new_versions = {}
+        for file_id, (_, _, _, external) in prepared.items():
+            row = rows_by_id[file_id]
+            recorded = external is not None and _record_external_change(
+                c, file_id, row["path"], *external
+            )
+            new_versions[file_id] = row["content_version"] + (2 if recorded else 1)
+            if recorded:
+                results[file_id].message += "（已记录一次界面之外的修改）"
+
+        # 替换阶段：逐个 rename，出错时把已替换的文件恢复成原文
+        replaced = []
+        try:
+            for file_id, (_, tmp_path, _, _) in prepared.items():
+                commit_temp(tmp_path, rows_by_id[file_id]["path"])
+                replaced.append(file_id)
+            for file_id in replaced:
+                c.execute(
+                    """
+                    UPDATE config_files
+                    SET content_version=?, encoding='utf-8', encoding_signature=?
+                    WHERE id=?
+                    """,
+                    (
+                        new_versions[file_id],
+                        format_signature(file_signature(rows_by_id[file_id]["path"])),
+                        file_id,
+                    ),
+                )
+            conn.commit()
+        except BaseException:
+            for file_id in replaced:
+                atomic_write(rows_by_id[file_id]["path"], prepared[file_id][0])
+            for file_id, (_, tmp_path, _, _) in prepared.items():
+                if file_id not in replaced:
+                    discard_temp(tmp_path)
+            raise
+
+        for file_id in replaced:
+            results[file_id].ok = True
+            results[file_id].content_version = new_versions[file_id]
+        return True, list(results.values())
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+        for file_id in file_ids:
+            config_cache.invalidate_file(file_id)
+        change_feed.poke()
@@ -0,0 +1,104 @@
+import os
+import multiprocessing
+
+
+def server_options():
+    """从 .env / 环境变量读取生产服务参数"""
+    cpu_count = multiprocessing.cpu_count()
+    return {
+        "host": os.getenv("APP_HOST", "0.0.0.0"),
+        "port": int(os.getenv("APP_PORT", 5000)),
+        "workers": int(os.getenv("WEB_WORKERS", cpu_count)),
+        "threads": int(os.getenv("WEB_THREADS", 8)),
+        "worker_class": os.getenv("WEB_WORKER_CLASS", "gthread"),
+        "worker_connections": int(os.getenv("WEB_WORKER_CONNECTIONS", 1000)),
+        "keepalive": int(os.getenv("WEB_KEEPALIVE", 5)),
+        "timeout": int(os.getenv("WEB_TIMEOUT", 30)),
+        "graceful_timeout": int(os.getenv("WEB_GRACEFUL_TIMEOUT", 30)),
+        "max_requests": int(os.getenv("WEB_MAX_REQUESTS", 0)),
+        "backlog": int(os.getenv("WEB_BACKLOG", 2048)),
+    }
+
+
+def run_gunicorn(app_factory, options):
+    """多进程 gunicorn（仅 Linux/macOS）
+
+    不预加载应用：每个 worker fork 之后各自调用 create_app()，
+    缓存、连接池和后台线程都在 worker 内初始化。
+    对 master 进程发送 HUP 信号即可平滑重载全部 worker。
+    WEB_WORKER_CLASS=gevent（需 pip install gevent）时每个连接是一个协程，
+    适合大量挂起的长轮询 / SSE 连接；默认 gthread 下每个挂起连接占一个线程。
+
+    多个 worker 写同一份日志，不能各自按时间轮转（会互相改名、删掉彼此的历史文件）：
+    worker 只写（LOG_ROTATION=master），由 master 进程每天 0 点统一轮转；
+    设为 external 时 master 也不轮转，交给 logrotate 等外部工具。
+    指标同理：每个 worker 把快照写到 METRICS_DIR，抓取任何一个 worker 都返回全部 worker 的合计。
+    """
+    from gunicorn.app.base import BaseApplication
+
+    import logsetup
+    import metrics
+
+    # worker 由 master fork，继承这里设置的环境变量
+    os.environ.setdefault("LOG_ROTATION", "master")
+    # 指标按 worker 分别记录，写到同一目录后由导出时合并；每次启动清空上次的数据
+    os.environ.setdefault("METRICS_DIR", os.path.join("run", "metrics"))
+    metrics.clear_multiprocess_dir(os.environ["METRICS_DIR"])
+
+    def when_ready(server):
+        if os.getenv("LOG_ROTATION") == "master":
+            logsetup.start_log_rotator()
+
+    class Application(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"{options['host']}:{options['port']}")
+            self.cfg.set("workers", options["workers"])
+            self.cfg.set("threads", options["threads"])
+            self.cfg.set("worker_class", options["worker_class"])
+            self.cfg.set("worker_connections", options["worker_connections"])
+            self.cfg.set("keepalive", options["keepalive"])
+            self.cfg.set("timeout", options["timeout"])
+            self.cfg.set("graceful_timeout", options["graceful_timeout"])
+            self.cfg.set("max_requests", options["max_requests"])
+            self.cfg.set("max_requests_jitter", options["max_requests"] // 10)
+            self.cfg.set("backlog", options["backlog"])
+            self.cfg.set("preload_app", False)
+            self.cfg.set("when_ready", when_ready)
+
+        def load(self):
+            return app_factory()
+
+    Application().run()
+
+
+def run_waitress(app_factory, options):
+    """单进程多线程 waitress（Windows 下使用）"""
+    from waitress import serve
+
+    serve(
+        app_factory(),
+        host=options["host"],
+        port=options["port"],
+        threads=options["threads"],
+        channel_timeout=options["timeout"],
+        backlog=options["backlog"],
+    )
+
+
+def run_production(app_factory):
+    """按平台选择生产服务器：优先 gunicorn，其次 waitress"""
+    options = server_options()
+    if os.name != "nt":
+        try:
+            import gunicorn  # noqa: F401
+        except ImportError:
+            pass
+        else:
+            return run_gunicorn(app_factory, options)
+    try:
+        import waitress  # noqa: F401
+    except ImportError:
+        raise SystemExit(
+            "未安装生产服务器，请执行 pip install gunicorn（Linux）或 pip install waitress（Windows）"
+        )
+    return run_waitress(app_factory, options)
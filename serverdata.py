@@ -0,0 +1,244 @@
+SERVER_FIELDS = ("srvid", "srvname", "srvip", "port", "urlsuffix", "state", "tag")
+# 顶部热更地址，只有有修改权限的用户可以改
+TOP_LEVEL_FIELDS = ("gmResURL", "gmWebResURL", "gmInitResURL")
+
+
+class OperationError(ValueError):
+    """操作列表不合法，信息里带上出错操作的序号"""
+
+
+def normalize_server(fields, base=None):
+    """按编辑页的规则整理一条服务器记录：字符串字段原样保存，tag 转为整数"""
+    server = dict(base) if base else {name: "" for name in SERVER_FIELDS}
+    for name, value in fields.items():
+        if name not in SERVER_FIELDS:
+            raise ValueError(f"未知字段 {name}")
+        if name == "tag":
+            try:
+                value = int(value) if value not in (None, "") else 0
+            except (TypeError, ValueError):
+                value = 0
+        else:
+            value = "" if value is None else str(value)
+        server[name] = value
+    if base is None and "tag" not in fields:
+        server["tag"] = 0
+    return server
+
+
+def server_list(config_data):
+    """返回 serverData 的副本；配置不是对象或其中某一项不是对象时抛出 OperationError"""
+    if not isinstance(config_data, dict):
+        raise OperationError("配置内容不是 JSON 对象")
+    servers = config_data.get("serverData")
+    if not isinstance(servers, list):
+        return []
+    for i, srv in enumerate(servers, start=1):
+        if not isinstance(srv, dict):
+            raise OperationError(f"serverData 第 {i} 项不是对象，无法按操作修改")
+    return list(servers)
+
+
+def apply_operations(config_data, operations, allow_top_level=False, ignore_missing=False):
+    """把操作列表应用到已解析的配置上（原地修改），返回修改后的 serverData
+
+    支持的操作（srvid 定位服务器）：
+      {"op": "add", "server": {...}, "index": 可选插入位置}
+      {"op": "update", "srvid": "1", "index": 可选当前位置, "fields": {"state": "hot"}}
+      {"op": "remove", "srvid": "1", "index": 可选当前位置}
+      {"op": "move", "srvid": "1", "index": 0}
+      {"op": "set", "field": "gmResURL", "value": "..."}   需要 allow_top_level
+    update/remove 带 index 时按位置定位，并校验该位置的 srvid 仍是 srvid（期间被别人改过则失败）；
+    不带 index 时 srvid 在文件中重复出现视为错误，不会只改第一个。
+    任何一个操作失败都会抛出 OperationError，调用方不应保存结果。
+    ignore_missing 为真时 update/remove/move 找不到 srvid 直接跳过（批量修改多个文件时使用）。
+    """
+    if not isinstance(operations, list):
+        raise OperationError("operations 必须是数组")
+
+    servers = server_list(config_data)
+
+    # srvid -> 所有位置；增删移动后位置会变，标记为失效按需重建
+    positions = None
+
+    def build_positions():
+        nonlocal positions
+        if positions is None:
+            positions = {}
+            for i, srv in enumerate(servers):
+                positions.setdefault(str(srv.get("srvid", "")), []).append(i)
+        return positions
+
+    def object_arg(op, name, number):
+        value = op.get(name) or {}
+        if not isinstance(value, dict):
+            raise OperationError(f"第 {number} 个操作：{name} 必须是对象")
+        return value
+
+    def locate(op, number, by_index=False):
+        srvid = str(op.get("srvid"))
+        found = build_positions().get(srvid)
+        if not found:
+            raise OperationError(f"第 {number} 个操作：srvid {srvid} 不存在")
+        if by_index and op.get("index") is not None:
+            i = int(op["index"])
+            if i not in found:
+                raise OperationError(
+                    f"第 {number} 个操作：第 {i + 1} 台服务器已不是 srvid {srvid}，请刷新后重试"
+                )
+            return i
+        if len(found) > 1:
+            raise OperationError(
+                f"第 {number} 个操作：srvid {srvid} 重复出现 {len(found)} 次，需要用 index 指定位置"
+            )
+        return found[0]
+
+    for number, op in enumerate(operations, start=1):
+        if not isinstance(op, dict):
+            raise OperationError(f"第 {number} 个操作格式错误")
+        kind = op.get("op")
+        try:
+            if kind == "add":
+                server = normalize_server(object_arg(op, "server", number))
+                if server["srvid"] and server["srvid"] in build_positions():
+                    raise OperationError(
+                        f"第 {number} 个操作：srvid {server['srvid']} 已存在"
+                    )
+                index = op.get("index")
+                if index is None:
+                    # srvid 为空时上面没有建立过索引，先建好再追加，否则 positions 还是 None
+                    build_positions().setdefault(server["srvid"], []).append(len(servers))
+                    servers.append(server)
+                else:
+                    servers.insert(int(index), server)
+                    positions = None
+            elif kind in ("update", "remove", "move") and ignore_missing and (
+                str(op.get("srvid")) not in build_positions()
+            ):
+                continue
+            elif kind == "update":
+                i = locate(op, number, by_index=True)
+                server = normalize_server(object_arg(op, "fields", number), servers[i])
+                old_srvid = str(servers[i].get("srvid", ""))
+                if server["srvid"] != old_srvid:
+                    # 改 srvid 不能与其他服务器重复，否则之后按 srvid 的操作无法区分
+                    if server["srvid"] and server["srvid"] in build_positions():
+                        raise OperationError(
+                            f"第 {number} 个操作：srvid {server['srvid']} 已存在"
+                        )
+                    positions = None
+                servers[i] = server
+            elif kind == "remove":
+                del servers[locate(op, number, by_index=True)]
+                positions = None
+            elif kind == "move":
+                server = servers.pop(locate(op, number))
+                servers.insert(int(op.get("index", 0)), server)
+                positions = None
+            elif kind == "set":
+                if not allow_top_level:
+                    raise OperationError(f"第 {number} 个操作：没有修改热更地址的权限")
+                field = op.get("field")
+                if field not in TOP_LEVEL_FIELDS:
+                    raise OperationError(f"第 {number} 个操作：不支持修改字段 {field}")
+                config_data[field] = "" if op.get("value") is None else str(op["value"])
+            else:
+                raise OperationError(f"第 {number} 个操作：未知操作 {kind}")
+        except OperationError:
+            raise
+        except (TypeError, ValueError) as e:
+            raise OperationError(f"第 {number} 个操作：{e}")
+
+    config_data["serverData"] = servers
+    return servers
+
+
+class ServerFilter:
+    """公共接口按查询参数筛选 serverData（同一参数多个值用逗号分隔）
+
+    ?tag=1,2&state=hot&srvid_min=100&srvid_max=199&page_size=50&page=2
+    srvid 范围按整数比较，srvid 不是整数的服务器不会落在任何范围内；
+    分页在筛选之后进行，page 从 1 开始，page_size 超过 MAX_PAGE_SIZE 时按 MAX_PAGE_SIZE 处理。
+    """
+
+    PARAMS = ("tag", "state", "srvid_min", "srvid_max", "page_size", "page")
+    MAX_PAGE_SIZE = 1000
+
+    def __init__(
+        self, tags=(), states=(), srvid_min=None, srvid_max=None, page_size=None, page=1
+    ):
+        self.tags = tags
+        self.states = states
+        self.srvid_min = srvid_min
+        self.srvid_max = srvid_max
+        self.page_size = page_size
+        self.page = page
+        # 参数规范化后的键，顺序不同但含义相同的请求共用同一份视图
+        self.key = (tags, states, srvid_min, srvid_max, page_size, page)
+
+    @classmethod
+    def from_args(cls, args):
+        """从查询参数构造；没有任何筛选参数时返回 None，参数不合法时抛出 ValueError"""
+        if not any(name in args for name in cls.PARAMS):
+            return None
+
+        def values(name):
+            raw = ",".join(args.getlist(name))
+            return tuple(sorted({v.strip() for v in raw.split(",") if v.strip()}))
+
+        def integer(name, minimum=None):
+            raw = args.get(name)
+            if raw in (None, ""):
+                return None
+            try:
+                value = int(raw)
+            except ValueError:
+                raise ValueError(f"{name} 必须是整数")
+            if minimum is not None and value < minimum:
+                raise ValueError(f"{name} 不能小于 {minimum}")
+            return value
+
+        page_size = integer("page_size", 1)
+        if page_size is not None:
+            page_size = min(page_size, cls.MAX_PAGE_SIZE)
+        page = integer("page", 1)
+        if page is not None and page_size is None:
+            raise ValueError("page 需要与 page_size 一起使用")
+        return cls(
+            values("tag"),
+            values("state"),
+            integer("srvid_min"),
+            integer("srvid_max"),
+            page_size,
+            page or 1,
+        )
+
+    def _matches(self, server):
+        if not isinstance(server, dict):
+            return False
+        if self.tags and str(server.get("tag", "")) not in self.tags:
+            return False
+        if self.states and str(server.get("state", "")) not in self.states:
+            return False
+        if self.srvid_min is not None or self.srvid_max is not None:
+            try:
+                srvid = int(server.get("srvid"))
+            except (TypeError, ValueError):
+                return False
+            if self.srvid_min is not None and srvid < self.srvid_min:
+                return False
+            if self.srvid_max is not None and srvid > self.srvid_max:
+                return False
+        return True
+
+    def select(self, servers):
+        """返回筛选（及分页）后选中的服务器下标"""
+        selected = [i for i, srv in enumerate(servers) if self._matches(srv)]
+        if self.page_size is not None:
+            start = (self.page - 1) * self.page_size
+            selected = selected[start : start + self.page_size]
+        return selected
+
+    def apply(self, servers):
+        """返回筛选（及分页）后的服务器列表，不修改传入的列表"""
+        return [servers[i] for i in self.select(servers)]
@@ -13,9 +13,9 @@ if "%PORT%"=="" (
 )
 
 REM -------------------------------
-REM 后台启动 Flask 应用并将日志写入 app.log
+REM 后台以生产模式启动应用（waitress 多线程服务器）并将日志写入 app.log
 REM 使用 start 新窗口启动，避免阻塞当前批处理
-start "" python -m flask run --host=0.0.0.0 --port=%PORT% --no-reload > app.log 2>&1
+start "" python app.py > app.log 2>&1
 
 REM -------------------------------
 REM 提示信息
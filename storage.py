@@ -0,0 +1,134 @@
+import os
+import time
+import tempfile
+
+import metrics
+import profiling
+
+# gb2312 是 gbk 的子集，utf-8-sig 能解的内容 utf-8 也能解，二者不再单独尝试；
+# latin-1 可以解码任意字节，放在最后兜底
+ENCODINGS = ["utf-8", "gbk", "latin-1"]
+
+
+def file_signature(path):
+    """返回文件签名 (mtime_ns, size, inode)，文件不存在时返回 None"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def format_signature(signature):
+    """文件签名序列化为字符串，便于存入数据库"""
+    if signature is None:
+        return None
+    return ":".join(str(part) for part in signature)
+
+
+def detect_encoding(raw):
+    """对已读入内存的字节探测编码，返回 (内容, 编码)"""
+    for encoding in ENCODINGS:
+        try:
+            return raw.decode(encoding), encoding
+        except UnicodeDecodeError:
+            continue
+    # latin-1 不会失败，这里只是保险
+    return raw.decode("latin-1", errors="replace"), "latin-1"
+
+
+def _normalize_newlines(content):
+    """与文本模式读取保持一致：\r\n 和 \r 统一为 \n"""
+    if "\r" in content:
+        content = content.replace("\r\n", "\n").replace("\r", "\n")
+    return content
+
+
+def read_file_content(path, encoding=None):
+    """一次二进制读取文本文件并解码，返回 (内容, 编码, 错误信息)
+
+    传入 encoding 时直接按该编码解码，失败才重新探测。
+    """
+    started = time.perf_counter()
+    try:
+        with open(path, "rb") as f:
+            raw = f.read()
+    except Exception as e:
+        metrics.observe_file_read(time.perf_counter() - started, False)
+        return None, None, str(e)
+    elapsed = time.perf_counter() - started
+    metrics.observe_file_read(elapsed, True)
+    profiling.add("file_read", elapsed)
+    content, encoding = decode_content(raw, encoding)
+    return content, encoding, None
+
+
+def decode_content(raw, encoding=None):
+    """解码已读入内存的文件内容，返回 (内容, 编码)；传入 encoding 时先按该编码解码"""
+    if encoding:
+        try:
+            return _normalize_newlines(raw.decode(encoding)), encoding
+        except (UnicodeDecodeError, LookupError):
+            pass
+    started = time.perf_counter()
+    content, encoding = detect_encoding(raw)
+    profiling.add("encoding_detect", time.perf_counter() - started)
+    return _normalize_newlines(content), encoding
+
+
+def write_temp(path, data):
+    """在目标文件同目录写入并 fsync 一个临时文件，返回临时文件路径"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(
+        dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        # 保留原文件的权限位
+        try:
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+        except OSError:
+            pass
+    except BaseException:
+        discard_temp(tmp_path)
+        raise
+    return tmp_path
+
+
+def commit_temp(tmp_path, path):
+    """把 write_temp 写好的临时文件 rename 覆盖到目标路径"""
+    try:
+        os.replace(tmp_path, path)
+    except BaseException:
+        discard_temp(tmp_path)
+        raise
+    _fsync_directory(os.path.dirname(os.path.abspath(path)))
+
+
+def discard_temp(tmp_path):
+    try:
+        os.unlink(tmp_path)
+    except OSError:
+        pass
+
+
+def atomic_write(path, data):
+    """原子写文件：写临时文件并 fsync 后 rename 覆盖，读者只会看到旧文件或完整的新文件"""
+    commit_temp(write_temp(path, data), path)
+
+
+def _fsync_directory(directory):
+    # 让 rename 本身落盘；Windows 不支持打开目录，忽略即可
+    if os.name == "nt":
+        return
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -1,11 +1,40 @@
 import os
 import json
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash
-from models import get_db_connection
-from werkzeug.security import generate_password_hash
+import hmac
+import base64
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify, current_app, Response
+from models import db_pool, get_db_connection
+from cache import FORMATS, RAW_CONTENT_TYPE, CachedPayload, config_cache, config_types
+from decoys import decoy_store
+from watcher import file_watcher
+from feed import change_feed
+from storage import file_signature, format_signature, read_file_content
+from publish import (
+    VersionConflict,
+    publish_config,
+    publish_many,
+    record_external_change,
+    serialize_config,
+)
+from serverdata import (
+    TOP_LEVEL_FIELDS,
+    OperationError,
+    ServerFilter,
+    apply_operations,
+    server_list,
+)
+from werkzeug.http import is_resource_modified
+from passwords import HashPoolBusy, hash_pool
+from authz import accessible_file_ids, authz_index, bump_version, can_access, is_admin
+import time
 import uuid
+import logging
+import metrics
+import logsetup
+import profiling
 
 views_bp = Blueprint("views", __name__)
+logger = logging.getLogger(__name__)
 
 
 # ===========================
@@ -26,28 +55,115 @@ def login_required(func):
 # ===========================
 # 配置文件列表
 # ===========================
+# 可排序的列；每列都有 (列, id) 的部分索引，翻页用键集分页，页数再多延迟也不变
+LIST_SORT_COLUMNS = ("id", "type", "name", "version", "created_time", "updated_time")
+LIST_PAGE_SIZE = 50
+LIST_MAX_PAGE_SIZE = 200
+
+
+def _encode_cursor(row, sort):
+    """把一行的 (排序列值, id) 编码成翻页游标"""
+    raw = json.dumps([row[sort], row["id"]], ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def _decode_cursor(text):
+    if not text:
+        return None
+    try:
+        value, row_id = json.loads(base64.urlsafe_b64decode(text.encode("ascii")))
+        return [value, int(row_id)]
+    except (ValueError, TypeError):
+        return None
+
+
+def _like_pattern(text):
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
 @views_bp.route("/")
 @login_required
 def index():
     user_id = session.get("user_id")
+
+    sort = request.args.get("sort", "id")
+    if sort not in LIST_SORT_COLUMNS:
+        sort = "id"
+    order = "asc" if request.args.get("order") == "asc" else "desc"
+    try:
+        per_page = int(request.args.get("per_page", LIST_PAGE_SIZE))
+    except ValueError:
+        per_page = LIST_PAGE_SIZE
+    per_page = max(1, min(per_page, LIST_MAX_PAGE_SIZE))
+    filters = {
+        key: request.args.get(key, "").strip() for key in ("type", "name", "version")
+    }
+    after = _decode_cursor(request.args.get("after"))
+    before = None if after else _decode_cursor(request.args.get("before"))
+
+    # 管理员查看全部，普通用户只看被授权的配置（授权取自内存索引，不再联表），
+    # 过滤、排序、分页都下推到 SQL
+    allowed = accessible_file_ids(user_id)
+    sql = "SELECT cf.* FROM config_files cf WHERE cf.delete_time IS NULL"
+    params = []
+    if allowed is not None:
+        sql += " AND cf.id IN (SELECT value FROM json_each(?))"
+        params.append(json.dumps(sorted(allowed)))
+    if filters["type"]:
+        sql += " AND cf.type = ?"
+        params.append(filters["type"])
+    if filters["name"]:
+        sql += " AND cf.name LIKE ? ESCAPE '\\'"
+        params.append(_like_pattern(filters["name"]))
+    if filters["version"]:
+        sql += " AND cf.version LIKE ? ESCAPE '\\'"
+        params.append(_like_pattern(filters["version"]))
+
+    # 往前翻页时反向查询再把结果倒过来
+    descending = (order == "desc") != (before is not None)
+    cursor = after or before
+    if cursor:
+        sql += f" AND (cf.{sort}, cf.id) {'<' if descending else '>'} (?, ?)"
+        params.extend(cursor)
+    direction = "DESC" if descending else "ASC"
+    sql += f" ORDER BY cf.{sort} {direction}, cf.id {direction} LIMIT ?"
+    params.append(per_page + 1)
+
     conn = get_db_connection()
     c = conn.cursor()
-    if user_id == 1:
-        c.execute(
-            "SELECT * FROM config_files WHERE delete_time IS NULL ORDER BY id DESC"
-        )
-    else:
-        c.execute(
-            """
-            SELECT cf.* FROM config_files cf
-            JOIN user_config_permissions ucp ON cf.id = ucp.config_file_id
-            WHERE ucp.user_id = ? AND cf.delete_time IS NULL
-        """,
-            (user_id,),
-        )
+    c.execute(sql, params)
     files = c.fetchall()
     conn.close()
-    return render_template("config_list.html", files=files)
+
+    has_more = len(files) > per_page
+    files = files[:per_page]
+    if before:
+        files.reverse()
+
+    next_cursor = prev_cursor = None
+    if files:
+        if has_more or before:
+            next_cursor = _encode_cursor(files[-1], sort)
+        if after or (before and has_more):
+            prev_cursor = _encode_cursor(files[0], sort)
+
+    list_args = {key: value for key, value in filters.items() if value}
+    list_args.update(sort=sort, order=order)
+    if per_page != LIST_PAGE_SIZE:
+        list_args["per_page"] = per_page
+
+    return render_template(
+        "config_list.html",
+        files=files,
+        filters=filters,
+        sort=sort,
+        order=order,
+        list_args=list_args,
+        next_cursor=next_cursor,
+        prev_cursor=prev_cursor,
+        is_admin=allowed is None,
+    )
 
 
 # ===========================
@@ -68,14 +184,35 @@ def add_config():
             flash("配置文件路径不存在", "error")
             return redirect(url_for("views.add_config"))
 
+        # 新增时探测一次文件编码并记录下来
+        signature = file_signature(path)
+        content, encoding, _ = read_file_content(path)
+        if content is None:
+            encoding = signature = None
+
         conn = get_db_connection()
         c = conn.cursor()
         c.execute(
-            "INSERT INTO config_files (type, uuid, name, version, path, remark) VALUES (?, ?, ?, ?, ?, ?)",
-            (type_, file_uuid, name, version, path, remark),
+            """
+            INSERT INTO config_files
+                (type, uuid, name, version, path, remark, encoding, encoding_signature)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                type_,
+                file_uuid,
+                name,
+                version,
+                path,
+                remark,
+                encoding,
+                format_signature(signature),
+            ),
         )
         conn.commit()
         conn.close()
+        config_types.set(file_uuid, type_)
+        file_watcher.refresh()
 
         flash("配置文件已添加", "success")
         return redirect(url_for("views.index"))
@@ -89,6 +226,9 @@ def add_config():
 @views_bp.route("/edit_config/<int:file_id>", methods=["GET", "POST"])
 @login_required
 def edit_config(file_id):
+    if not can_access(session.get("user_id"), file_id):
+        return "无权限访问", 403
+
     conn = get_db_connection()
     c = conn.cursor()
     c.execute(
@@ -116,6 +256,10 @@ def edit_config(file_id):
         )
         conn.commit()
         conn.close()
+        config_cache.invalidate_file(file_id)
+        config_types.set(file["uuid"], type_)
+        if path != file["path"]:
+            file_watcher.refresh()
 
         flash("配置文件信息已更新", "success")
         return redirect(url_for("views.index"))
@@ -129,6 +273,9 @@ def edit_config(file_id):
 @views_bp.route("/delete_config/<int:file_id>")
 @login_required
 def delete_config(file_id):
+    if not can_access(session.get("user_id"), file_id):
+        return "无权限访问", 403
+
     conn = get_db_connection()
     c = conn.cursor()
     c.execute(
@@ -136,6 +283,8 @@ def delete_config(file_id):
     )
     conn.commit()
     conn.close()
+    config_cache.invalidate_file(file_id)
+    config_types.reload()
     flash("配置文件已删除", "success")
     return redirect(url_for("views.index"))
 
@@ -143,9 +292,16 @@ def delete_config(file_id):
 # ===========================
 # 编辑配置文件内容（JSON）
 # ===========================
-@views_bp.route("/edit_content/<int:file_id>", methods=["GET", "POST"])
+@views_bp.route("/edit_content/<int:file_id>")
 @login_required
 def edit_content(file_id):
+    """编辑页只负责展示；所有修改经 /edit_content/<id>/operations 按操作列表提交"""
+    user_id = session.get("user_id")
+    if not can_access(user_id, file_id):
+        return "无权限访问", 403
+    # 热更地址只有有修改权限的用户能改
+    can_edit_top = can_access(user_id, file_id, edit=True)
+
     conn = get_db_connection()
     c = conn.cursor()
     c.execute(
@@ -157,127 +313,301 @@ def edit_content(file_id):
     if not file:
         flash("配置文件不存在", "error")
         return redirect(url_for("views.index"))
+    profiling.mark("db_query")
 
     path = file["path"]
 
     # 读取 JSON 配置
     try:
-        print(f"正在读取配置文件: {path}")
+        logger.debug("读取配置文件", extra={"fields": {"config_file_id": file_id, "path": path}})
+        config_data = load_config_data(file, readonly=True)
+        profiling.mark("load_config")
+    except json.JSONDecodeError as e:
+        fields = {"config_file_id": file_id, "path": path, "line": e.lineno, "column": e.colno}
+        # 出错位置附近的原文只在显式开启时记录，避免配置内容进入日志
+        if logsetup.payload_excerpts:
+            fields["excerpt"] = e.doc[max(0, e.pos - 50) : e.pos + 50]
+        logger.warning("配置文件 JSON 解析失败: %s", e.msg, extra={"fields": fields})
+        flash(f"JSON格式错误: {e}", "error")
+        return redirect(url_for("views.index"))
+    except Exception as e:
+        logger.warning(
+            "配置文件读取失败: %s", e, extra={"fields": {"config_file_id": file_id, "path": path}}
+        )
+        flash(f"配置文件读取失败: {e}", "error")
+        return redirect(url_for("views.index"))
 
-        # 尝试不同的编码格式
-        encodings = ["utf-8", "gbk", "gb2312", "utf-8-sig", "latin-1"]
-        content = None
+    html = render_template(
+        "edit_content.html",
+        file=file,
+        config=config_data,
+        user_permission=1 if can_edit_top else 0,
+    )
+    profiling.mark("render")
+    return html
 
-        for encoding in encodings:
-            try:
-                with open(path, "r", encoding=encoding) as f:
-                    content = f.read()
-                    print(f"使用编码 {encoding} 成功读取文件")
-                    break
-            except UnicodeDecodeError:
-                print(f"编码 {encoding} 失败，尝试下一个...")
-                continue
 
-        if content is None:
-            raise Exception("无法使用任何编码读取文件")
+# ===========================
+# 分页读取 serverData（编辑页按需加载）
+# ===========================
+SERVER_PAGE_SIZE = 100
+SERVER_MAX_PAGE_SIZE = 500
+
 
-        print(f"文件内容长度: {len(content)} 字符")
-        print(f"文件内容前100字符: {content[:100]}")
+@views_bp.route("/edit_content/<int:file_id>/servers")
+def edit_content_servers(file_id):
+    """按页返回服务器列表，q 按 srvid/srvname/srvip 模糊搜索
 
-        # 检查并移除UTF-8 BOM（如果存在）
-        if content.startswith("\ufeff"):
-            content = content[1:]
-            print("已移除UTF-8 BOM标记")
+    数据来自缓存中按内容版本解析好的配置，页面大小和渲染耗时都与服务器总数无关。
+    """
+    if session.get("user_id") is None:
+        return jsonify(error="未登录"), 401
+    if not can_access(session.get("user_id"), file_id):
+        return jsonify(error="无权限访问"), 403
 
-        config_data = json.loads(content)
-        print("JSON解析成功")
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(
+        "SELECT * FROM config_files WHERE id=? AND delete_time IS NULL", (file_id,)
+    )
+    file = c.fetchone()
+    conn.close()
+    if not file:
+        return jsonify(error="配置文件不存在"), 404
 
+    entry = config_cache.get(file["uuid"])
+    if entry is None:
+        entry, err = _load_payload(file)
+        if entry is None:
+            return jsonify(error=f"配置文件读取失败: {err}"), 500
+    try:
+        servers = entry.servers()
     except json.JSONDecodeError as e:
-        print(f"JSON解析错误: {e}")
-        print(f"错误位置: 行 {e.lineno}, 列 {e.colno}")
-        flash(f"JSON格式错误: {e}", "error")
-        return redirect(url_for("views.index"))
+        return jsonify(error=f"JSON格式错误: {e}"), 422
+
+    offset = max(0, request.args.get("offset", 0, type=int))
+    limit = request.args.get("limit", SERVER_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, SERVER_MAX_PAGE_SIZE))
+    q = request.args.get("q", "").strip().lower()
+
+    if q:
+        matched = [i for i, key in enumerate(entry.search_keys()) if q in key]
+    else:
+        matched = range(len(servers))
+
+    return jsonify(
+        content_version=file["content_version"],
+        total=len(servers),
+        matched=len(matched),
+        offset=offset,
+        limit=limit,
+        servers=[
+            {"index": i, "server": servers[i]} for i in matched[offset : offset + limit]
+        ],
+    )
+
+
+# ===========================
+# 按操作列表修改 serverData（JSON 接口）
+# ===========================
+@views_bp.route("/edit_content/<int:file_id>/operations", methods=["POST"])
+def edit_content_operations(file_id):
+    """请求体: {"content_version": 可选, "operations": [...]}，返回新的内容版本"""
+    user_id = session.get("user_id")
+    if user_id is None:
+        return jsonify(error="未登录"), 401
+    if not can_access(user_id, file_id):
+        return jsonify(error="无权限访问"), 403
+
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify(error="请求体必须是 JSON 对象"), 400
+
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(
+        "SELECT * FROM config_files WHERE id=? AND delete_time IS NULL", (file_id,)
+    )
+    file = c.fetchone()
+    conn.close()
+    if not file:
+        return jsonify(error="配置文件不存在"), 404
+
+    # 未带版本号时以读取时的版本为准，读取后有人保存同样会冲突
+    expected_version = payload.get("content_version", file["content_version"])
+    if expected_version != file["content_version"]:
+        conflict = VersionConflict(file["content_version"])
+        return jsonify(error=str(conflict), content_version=conflict.current_version), 409
+    try:
+        config_data = load_config_data(file)
+        apply_operations(
+            config_data,
+            payload.get("operations"),
+            allow_top_level=can_access(user_id, file_id, edit=True),
+        )
+        new_version = publish_config(file_id, config_data, expected_version)
+    except OperationError as e:
+        return jsonify(error=str(e)), 400
+    except VersionConflict as e:
+        return jsonify(error=str(e), content_version=e.current_version), 409
+    except json.JSONDecodeError as e:
+        return jsonify(error=f"JSON格式错误: {e}"), 422
     except Exception as e:
-        print(f"文件读取错误: {e}")
-        flash(f"配置文件读取失败: {e}", "error")
-        return redirect(url_for("views.index"))
+        return jsonify(error=f"保存失败: {e}"), 500
 
-    if request.method == "POST":
-        # 更新热更地址
-        gm_web_res_url = request.form.get("gmWebResURL")
-        if gm_web_res_url is not None:
-            config_data["gmWebResURL"] = gm_web_res_url
-            
-        gm_init_res_url = request.form.get("gmInitResURL")
-        if gm_init_res_url is not None:
-            config_data["gmInitResURL"] = gm_init_res_url
-            
-        gm_res_url = request.form.get("gmResURL")
-        if gm_res_url is not None:
-            config_data["gmResURL"] = gm_res_url
-
-        # 重新构建 serverData
-        new_server_data = []
-        idx = 0
-        while True:
-            srvid = request.form.get(f"srvid_{idx}")
-            if srvid is None:  # 没有更多数据了
-                break
-
-            srvname = request.form.get(f"srvname_{idx}", "")
-            srvip = request.form.get(f"srvip_{idx}", "")
-            port = request.form.get(f"port_{idx}", "")
-            urlsuffix = request.form.get(f"urlsuffix_{idx}", "")
-            state = request.form.get(f"state_{idx}", "")
-            tag = request.form.get(f"tag_{idx}", "0")
-
-            # 只有当至少有一个字段有值时才添加
-            if srvid or srvname or srvip or port or urlsuffix or state or tag:
-                try:
-                    tag_value = int(tag) if tag else 0
-                except ValueError:
-                    tag_value = 0
-
-                new_server_data.append(
-                    {
-                        "srvid": srvid,
-                        "srvname": srvname,
-                        "srvip": srvip,
-                        "port": port,
-                        "urlsuffix": urlsuffix,
-                        "state": state,
-                        "tag": tag_value,
-                    }
-                )
+    row = _query_active_config(file["uuid"])
+    if row:
+        _load_payload(row)
+
+    return jsonify(
+        content_version=new_version, server_count=len(config_data["serverData"])
+    )
+
+
+# ===========================
+# 批量修改多个配置文件（仅管理员）
+# ===========================
+def _bulk_form_operations(form):
+    """把批量修改表单转换为 config_data -> 操作列表 的函数
+
+    srvid 用逗号或空白分隔，填 * 表示文件中的全部服务器；字段留空表示不修改。
+    """
+    srvids = form.get("srvids", "").replace(",", " ").split()
+    fields = {
+        name: form.get(name).strip()
+        for name in ("state", "tag")
+        if form.get(name, "").strip() != ""
+    }
+    top_level = [
+        {"op": "set", "field": name, "value": form.get(name).strip()}
+        for name in TOP_LEVEL_FIELDS
+        if form.get(name, "").strip() != ""
+    ]
+
+    def build(config_data):
+        if "*" in srvids:
+            # 按位置逐台修改，srvid 重复的服务器也都能改到
+            server_ops = [
+                {"op": "update", "srvid": str(srv.get("srvid", "")), "index": i, "fields": fields}
+                for i, srv in enumerate(config_data.get("serverData") or [])
+            ]
+        else:
+            server_ops = [{"op": "update", "srvid": srvid, "fields": fields} for srvid in srvids]
+        return (server_ops if fields else []) + top_level
+
+    return build
+
+
+def _bulk_json_operations(operations):
+    """JSON 请求的操作列表：srvid 为 * 的 update/remove 在每个文件里展开为全部服务器"""
+
+    def build(config_data):
+        if not isinstance(operations, list):
+            return operations
+        servers = config_data.get("serverData") or []
+        expanded = []
+        for op in operations:
+            if (
+                isinstance(op, dict)
+                and op.get("op") in ("update", "remove")
+                and op.get("srvid") == "*"
+            ):
+                targets = [
+                    dict(op, srvid=str(srv.get("srvid", "")), index=i)
+                    for i, srv in enumerate(servers)
+                ]
+                # 从后往前删除，前面服务器的位置不受影响
+                expanded.extend(reversed(targets) if op["op"] == "remove" else targets)
+            else:
+                expanded.append(op)
+        return expanded
 
-            idx += 1
+    return build
 
-        config_data["serverData"] = new_server_data
 
-        # 写回文件
+@views_bp.route("/bulk_edit", methods=["GET", "POST"])
+def bulk_edit():
+    """同一组修改应用到多个配置文件：表单提交或 JSON 请求
+
+    JSON 请求体: {"config_file_ids": [...], "operations": [...]}，操作格式同单文件接口，
+    update/remove 的 srvid 可以是 "*"，表示文件中的全部服务器（与表单一致）。
+    """
+    if not is_admin(session.get("user_id")):
+        return "无权限访问", 403
+
+    results = None
+    if request.method == "POST":
+        if request.is_json:
+            payload = request.get_json(silent=True) or {}
+            file_ids = payload.get("config_file_ids") or []
+            build_operations = _bulk_json_operations(payload.get("operations"))
+        else:
+            file_ids = request.form.getlist("config_file_ids")
+            build_operations = _bulk_form_operations(request.form)
+
         try:
-            with open(path, "w", encoding="utf-8") as f:
-                json.dump(config_data, f, ensure_ascii=False, indent=4)
-            flash("配置内容已更新", "success")
-        except Exception as e:
-            flash(f"保存失败: {e}", "error")
+            file_ids = sorted({int(file_id) for file_id in file_ids})
+        except (TypeError, ValueError):
+            file_ids = []
+
+        def transform(config_data):
+            existing = {str(srv.get("srvid", "")) for srv in server_list(config_data)}
+            operations = build_operations(config_data)
+            matched = sum(
+                1
+                for op in operations or []
+                if isinstance(op, dict)
+                and op.get("op") == "update"
+                and str(op.get("srvid")) in existing
+            )
+            apply_operations(
+                config_data, operations, allow_top_level=True, ignore_missing=True
+            )
+            return f"已修改 {matched} 台服务器"
 
-        return redirect(url_for("views.index"))
+        if not file_ids:
+            ok, results = False, []
+            if not request.is_json:
+                flash("请至少选择一个配置文件", "error")
+        else:
+            ok, results = publish_many(file_ids, transform)
+            if not request.is_json:
+                if ok:
+                    flash(f"已批量修改 {len(results)} 个配置文件", "success")
+                else:
+                    flash("批量修改失败，所有文件均未修改", "error")
+
+        if request.is_json:
+            return (
+                jsonify(
+                    ok=ok,
+                    results=[
+                        {
+                            "config_file_id": r.file_id,
+                            "name": r.name,
+                            "ok": r.ok,
+                            "message": r.message,
+                            "content_version": r.content_version,
+                        }
+                        for r in results
+                    ],
+                ),
+                200 if ok else 422,
+            )
 
-    # 获取当前用户的权限信息
-    user_id = session.get("user_id")
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute("SELECT permission FROM users WHERE id=?", (user_id,))
-    user_row = c.fetchone()
-    user_permission = user_row[0] if user_row else 0
+    c.execute(
+        "SELECT id, type, name, version FROM config_files WHERE delete_time IS NULL ORDER BY type, name"
+    )
+    config_files = c.fetchall()
     conn.close()
 
     return render_template(
-        "edit_content.html",
-        file=file,
-        config=config_data,
-        user_permission=user_permission,
+        "bulk_edit.html",
+        config_files=config_files,
+        results=results,
+        top_level_fields=TOP_LEVEL_FIELDS,
     )
 
 
@@ -378,25 +708,68 @@ def edit_content(file_id):
 #     )
 
 
+def _load_user_permissions(cursor, user_ids):
+    """一次分组查询取出多个用户可访问的（未删除）配置文件ID集合"""
+    user_permissions = {user_id: set() for user_id in user_ids}
+    if not user_ids:
+        return user_permissions
+    placeholders = ",".join("?" * len(user_ids))
+    cursor.execute(
+        f"""
+        SELECT ucp.user_id, GROUP_CONCAT(ucp.config_file_id)
+        FROM user_config_permissions ucp
+        JOIN config_files cf ON cf.id = ucp.config_file_id
+        WHERE ucp.user_id IN ({placeholders}) AND cf.delete_time IS NULL
+        GROUP BY ucp.user_id
+        """,
+        list(user_ids),
+    )
+    for user_id, ids in cursor.fetchall():
+        user_permissions[user_id] = {int(cfid) for cfid in ids.split(",")}
+    return user_permissions
+
+
+def _save_user_permissions(db, user_id, permission, config_file_ids):
+    """在一个事务内按差异保存用户的修改权限和配置文件访问权限"""
+    cursor = db.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        cursor.execute(
+            "UPDATE users SET permission = ? WHERE id = ? AND permission IS NOT ?",
+            (permission, user_id, permission),
+        )
+        current = _load_user_permissions(cursor, [user_id])[user_id]
+        to_add = config_file_ids - current
+        to_remove = current - config_file_ids
+        cursor.executemany(
+            "INSERT OR IGNORE INTO user_config_permissions (user_id, config_file_id) VALUES (?, ?)",
+            [(user_id, cfid) for cfid in sorted(to_add)],
+        )
+        cursor.executemany(
+            "DELETE FROM user_config_permissions WHERE user_id = ? AND config_file_id = ?",
+            [(user_id, cfid) for cfid in sorted(to_remove)],
+        )
+        bump_version(cursor)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    authz_index.invalidate(user_id)
+    return len(to_add), len(to_remove)
+
+
 @views_bp.route("/manage_permissions", methods=["GET", "POST"])
 def manage_permissions():
     # 只允许用户ID为1访问
-    if session.get("user_id") != 1:
+    if not is_admin(session.get("user_id")):
         return "无权限访问", 403
 
     db = get_db_connection()
     cursor = db.cursor()
 
-    # 查询所有用户和配置文件（包含permission字段）
-    cursor.execute(
-        "SELECT id, username, permission FROM users WHERE delete_time IS NULL"
-    )
-    users = cursor.fetchall()
-    cursor.execute("SELECT id, name FROM config_files WHERE delete_time IS NULL")
-    config_files = cursor.fetchall()
-
     # 默认选中第一个用户
-    selected_user_id = users[0][0] if users else None
+    cursor.execute("SELECT MIN(id) FROM users WHERE delete_time IS NULL")
+    selected_user_id = cursor.fetchone()[0]
 
     if request.method == "POST":
         selected_user_id = int(request.form.get("user_id", selected_user_id))
@@ -406,59 +779,30 @@ def manage_permissions():
             # 获取当前用户ID和修改权限
             current_user_id = int(request.form.get("current_user_id"))
             new_permission = int(request.form.get("permission"))
+            config_file_ids = {int(cfid) for cfid in request.form.getlist("config_file_ids")}
 
-            # 保存修改权限
-            cursor.execute(
-                "UPDATE users SET permission = ? WHERE id = ?",
-                (new_permission, current_user_id),
+            added, removed = _save_user_permissions(
+                db, current_user_id, new_permission, config_file_ids
             )
+            flash(f"所有权限设置已更新（新增 {added} 项，移除 {removed} 项）")
 
-            # 保存配置文件访问权限
-            config_file_ids = request.form.getlist("config_file_ids")
-            # 先删除该用户所有访问权限
-            cursor.execute(
-                "DELETE FROM user_config_permissions WHERE user_id=?",
-                (current_user_id,),
-            )
-            # 再插入新的访问权限
-            for cfid in config_file_ids:
-                cursor.execute(
-                    "INSERT INTO user_config_permissions (user_id, config_file_id) VALUES (?, ?)",
-                    (current_user_id, int(cfid)),
-                )
-
-            db.commit()
-            flash("所有权限设置已更新")
-
-            # 重新查询用户以获取更新后的权限
-            cursor.execute(
-                "SELECT id, username, permission FROM users WHERE delete_time IS NULL"
-            )
-            users = cursor.fetchall()
-
-            # 重新查询用户权限
-            user_permissions = {}
-            for user in users:
-                cursor.execute(
-                    "SELECT config_file_id FROM user_config_permissions WHERE user_id=?",
-                    (user[0],),
-                )
-                user_permissions[user[0]] = set(row[0] for row in cursor.fetchall())
-
-        # 切换用户的逻辑保持不变
         # 如果是切换用户（action == 'switch'），什么都不做，只回显
 
     elif request.method == "GET":
         selected_user_id = int(request.args.get("user_id", selected_user_id))
 
-    # 查询每个用户已分配的文件
-    user_permissions = {}
-    for user in users:
-        cursor.execute(
-            "SELECT config_file_id FROM user_config_permissions WHERE user_id=?",
-            (user[0],),
-        )
-        user_permissions[user[0]] = set(row[0] for row in cursor.fetchall())
+    # 查询所有用户和配置文件（包含permission字段）
+    cursor.execute(
+        "SELECT id, username, permission FROM users WHERE delete_time IS NULL"
+    )
+    users = cursor.fetchall()
+    cursor.execute("SELECT id, name FROM config_files WHERE delete_time IS NULL")
+    config_files = cursor.fetchall()
+
+    # 只查询当前选中用户的授权，其他用户切换时按需加载
+    user_permissions = _load_user_permissions(
+        cursor, [selected_user_id] if selected_user_id else []
+    )
 
     return render_template(
         "manage_permissions.html",
@@ -469,10 +813,32 @@ def manage_permissions():
     )
 
 
+@views_bp.route("/manage_permissions/<int:user_id>")
+def user_permissions_json(user_id):
+    """按需加载单个用户的授权（权限管理页切换用户时调用）"""
+    if not is_admin(session.get("user_id")):
+        return jsonify(error="无权限访问"), 403
+
+    db = get_db_connection()
+    cursor = db.cursor()
+    cursor.execute(
+        "SELECT permission FROM users WHERE id = ? AND delete_time IS NULL", (user_id,)
+    )
+    user = cursor.fetchone()
+    if not user:
+        return jsonify(error="用户不存在"), 404
+    grants = _load_user_permissions(cursor, [user_id])[user_id]
+    return jsonify(
+        user_id=user_id,
+        permission=user["permission"],
+        config_file_ids=sorted(grants),
+    )
+
+
 @views_bp.route("/add_user", methods=["GET", "POST"])
 def add_user():
     # 只允许管理员访问
-    if session.get("user_id") != 1:
+    if not is_admin(session.get("user_id")):
         return "无权限访问", 403
 
     if request.method == "POST":
@@ -486,11 +852,16 @@ def add_user():
             try:
                 c.execute(
                     "INSERT INTO users (username, password) VALUES (?, ?)",
-                    (username, generate_password_hash(password)),  # 实际项目应加密密码
+                    (username, hash_pool.generate(password)),
                 )
+                new_user_id = c.lastrowid
+                bump_version(c)
                 conn.commit()
+                authz_index.invalidate(new_user_id)
                 flash("用户添加成功", "success")
                 return redirect(url_for("views.add_user"))
+            except HashPoolBusy:
+                flash("添加失败：服务器繁忙，请稍后再试", "error")
             except Exception as e:
                 flash(f"添加失败：{e}", "error")
             finally:
@@ -498,93 +869,460 @@ def add_user():
     return render_template("add_user.html")
 
 
-from flask import send_file, abort
+# ===========================
+# 运行状态（仅管理员）
+# ===========================
+@views_bp.route("/admin/stats")
+def admin_stats():
+    if not is_admin(session.get("user_id")):
+        return "无权限访问", 403
+    return jsonify(
+        db_pool=db_pool.stats(),
+        config_cache=config_cache.stats(),
+        file_watcher=file_watcher.stats(),
+        change_feed=change_feed.stats(),
+        pid=os.getpid(),
+    )
 
 
-def read_file_content(path):
-    """尝试多种编码读取文本文件内容，失败返回None和错误信息"""
-    encodings = ["utf-8", "gbk", "gb2312", "utf-8-sig", "latin-1"]
-    for encoding in encodings:
-        try:
-            with open(path, "r", encoding=encoding) as f:
-                return f.read(), None
-        except UnicodeDecodeError:
-            continue
-        except Exception as e:
-            return None, str(e)
-    return None, "无法使用任何编码读取文件"
+# ===========================
+# Prometheus 指标（仅管理员）
+# ===========================
+@views_bp.route("/admin/metrics")
+def admin_metrics():
+    if not is_admin(session.get("user_id")):
+        return "无权限访问", 403
+    return metrics.registry.render(), 200, {
+        "Content-Type": "text/plain; version=0.0.4; charset=utf-8"
+    }
 
 
-@views_bp.route("/api/config/<string:file_id>", methods=["GET"])
-def public_get_config(file_id):
-    user_agent = request.headers.get("User-Agent", "")
+# ===========================
+# 按路由抽样 cProfile（仅管理员，开关与结果经 PROFILE_DIR 在所有 worker 间共享）
+# ===========================
+@views_bp.route("/admin/profile", methods=["GET", "POST"])
+def admin_profile():
+    if not is_admin(session.get("user_id")):
+        return "无权限访问", 403
+    if request.method == "POST":
+        data = request.get_json(silent=True) or request.form
+        if data.get("action") == "stop":
+            profiling.route_profiler.stop()
+        else:
+            endpoint = data.get("endpoint", "")
+            if endpoint not in current_app.view_functions:
+                return jsonify(error=f"路由 {endpoint} 不存在"), 400
+            try:
+                sample_rate = min(max(float(data.get("sample_rate", 0.1)), 0.0), 1.0)
+                max_samples = max(int(data.get("max_samples", 100)), 1)
+            except (TypeError, ValueError):
+                return jsonify(error="sample_rate / max_samples 格式错误"), 400
+            profiling.route_profiler.start(endpoint, sample_rate, max_samples)
+    return jsonify(profiling.route_profiler.status())
+
+
+@views_bp.route("/admin/profile/stats")
+def admin_profile_stats():
+    """下载所有 worker 合并后的 cProfile 结果：默认 pstats 二进制，format=text 返回排序后的文本"""
+    if not is_admin(session.get("user_id")):
+        return "无权限访问", 403
+    if request.args.get("format") == "text":
+        report = profiling.route_profiler.report(
+            sort=request.args.get("sort", "cumulative"),
+            limit=request.args.get("limit", 50, type=int),
+        )
+        if report is None:
+            return "尚未采集到数据", 404
+        return report, 200, {"Content-Type": "text/plain; charset=utf-8"}
+    data = profiling.route_profiler.dump()
+    if data is None:
+        return "尚未采集到数据", 404
+    return data, 200, {
+        "Content-Type": "application/octet-stream",
+        "Content-Disposition": "attachment; filename=profile.pstats",
+    }
+
+
+# ===========================
+# 界面之外的配置文件修改记录（仅管理员）
+# ===========================
+@views_bp.route("/admin/file_events")
+def admin_file_events():
+    if not is_admin(session.get("user_id")):
+        return "无权限访问", 403
+    limit = min(request.args.get("limit", 100, type=int) or 100, 1000)
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(
+        """
+        SELECT e.id, e.config_file_id, f.name, e.path, e.event, e.signature, e.created_time
+        FROM config_file_events e
+        LEFT JOIN config_files f ON f.id = e.config_file_id
+        ORDER BY e.id DESC
+        LIMIT ?
+        """,
+        (limit,),
+    )
+    events = [dict(row) for row in c.fetchall()]
+    conn.close()
+    return jsonify(events=events)
+
+
+from flask import abort
+
 
+def _query_active_config(file_uuid):
     conn = get_db_connection()
     c = conn.cursor()
     c.execute(
-        "SELECT * FROM config_files WHERE uuid=? AND delete_time IS NULL", (file_id,)
+        "SELECT * FROM config_files WHERE uuid=? AND delete_time IS NULL", (file_uuid,)
     )
     row = c.fetchone()
     conn.close()
+    return row
 
-    # 文件不存在的情况
-    if not row or not os.path.exists(row["path"]):
-        # User-Agent 不符时，返回 qu 或 modlist 文件内容
-        if not user_agent.startswith("Dalvik"):
-            # type为qu或找不到都返回qu，否则返回modlist
-            if not row or row.get("type") == "qu":
-                qu_path = os.path.join(
-                    os.path.dirname(__file__), "err_return", "qu.txt"
-                )
-                content, err = read_file_content(qu_path)
-                if content:
-                    return (
-                        content,
-                        200,
-                        {"Content-Type": "application/json; charset=utf-8"},
-                    )
-                else:
-                    return "qu文件读取失败: " + (err or ""), 500
-            else:
-                modlist_path = os.path.join(
-                    os.path.dirname(__file__), "err_return", "modlist.txt"
-                )
-                content, err = read_file_content(modlist_path)
-                if content:
-                    return (
-                        content,
-                        200,
-                        {"Content-Type": "application/json; charset=utf-8"},
-                    )
-                else:
-                    return "modlist文件读取失败: " + (err or ""), 500
-        # User-Agent 符合时，直接404
-        abort(404)
 
-    # 文件存在
+def read_config_text(row, signature=None):
+    """按记录的编码读取配置文件，返回 (内容, 编码, 错误信息)
+
+    文件签名与记录一致时直接用已知编码解码；文件变化后才重新探测，
+    并作为一次外部修改记录下来（递增内容版本、写回编码）。
+    """
     path = row["path"]
+    if signature is None:
+        signature = file_signature(path)
+    signature_text = format_signature(signature)
+    known = row["encoding"] if row["encoding_signature"] == signature_text else None
+
+    content, encoding, err = read_file_content(path, known)
+    if content is not None and row["encoding_signature"] != signature_text:
+        record_external_change(row["id"], path, signature, encoding)
+    return content, encoding, err
+
+
+def load_config_data(row, readonly=False):
+    """读取并解析配置 JSON，缓存中有当前内容时直接解析缓存，不再读盘
+
+    readonly 为真时返回缓存条目里共享的解析结果（同一内容版本只解析一次），调用方不得修改。
+    """
+    entry = config_cache.get(row["uuid"])
+    if entry is not None:
+        if readonly:
+            return entry.parsed()
+        content = entry.body.decode("utf-8")
+    else:
+        content, _, err = read_config_text(row)
+        if content is None:
+            raise Exception(err or "无法使用任何编码读取文件")
+
+    # 检查并移除UTF-8 BOM（如果存在）
+    if content.startswith("\ufeff"):
+        content = content[1:]
+    started = time.perf_counter()
+    config_data = json.loads(content)
+    profiling.add("json_parse", time.perf_counter() - started)
+    return config_data
+
+
+def _load_payload(row):
+    """读取真实配置文件并写入缓存，返回 (CachedPayload, 错误信息)"""
+    path = row["path"]
+    # 先取签名再读内容：读取期间文件若被改写，下次请求会因签名不一致重新加载
+    signature = file_signature(path)
+    content, _, err = read_config_text(row, signature)
+    if not content:
+        return None, err
+    entry = CachedPayload(
+        row["id"], row["uuid"], row["type"], path, signature, content.encode("utf-8")
+    )
+    config_cache.put(entry)
+    return entry, None
+
+
+@views_bp.route("/api/config/<string:file_id>", methods=["GET"])
+def public_get_config(file_id):
+    user_agent = request.headers.get("User-Agent", "")
+
+    # User-Agent 不符时返回 qu 或 modlist 伪装内容，只查内存，不访问数据库和磁盘
     if not user_agent.startswith("Dalvik"):
-        # type为qu返回qu，否则modlist
-        if row["type"] == "qu":
-            qu_path = os.path.join(os.path.dirname(__file__), "err_return", "qu.txt")
-            content, err = read_file_content(qu_path)
-            if content:
-                return content, 200, {"Content-Type": "application/json; charset=utf-8"}
-            else:
-                return "qu文件读取失败: " + (err or ""), 500
-        else:
-            modlist_path = os.path.join(
-                os.path.dirname(__file__), "err_return", "modlist.txt"
+        metrics.set_outcome("decoy", "decoy")
+        return decoy_store.response(config_types.get(file_id))
+
+    outcome = "hit"
+    entry = config_cache.get(file_id)
+    profiling.mark("cache_lookup")
+    if entry is None:
+        outcome = "load"
+        generation = change_feed.generation
+        row = _query_active_config(file_id)
+        profiling.mark("db_query")
+        # 文件不存在时直接404
+        if not row or not os.path.exists(row["path"]):
+            metrics.set_outcome("dalvik", "not_found")
+            abort(404)
+
+        entry, err = _load_payload(row)
+        profiling.mark("file_load")
+        if entry is None:
+            metrics.set_outcome("dalvik", "error")
+            return f"文件读取异常: {err}", 500
+        # 查询之后其他 worker 修改或删除了配置时，刚写入的条目可能已过期，不留在缓存里
+        if change_feed.generation != generation:
+            config_cache.invalidate(file_id)
+
+    return send_cached_payload(entry, outcome)
+
+
+# 可按 Accept 协商的表示；application/x-msgpack 视同 application/msgpack。
+# 压缩 JSON 不在此列：已有客户端可能本来就发送 Accept: application/json，它们应继续拿到原文
+_FORMAT_MIMETYPES = {}
+if "msgpack" in FORMATS:
+    _FORMAT_MIMETYPES["application/msgpack"] = "msgpack"
+    _FORMAT_MIMETYPES["application/x-msgpack"] = "msgpack"
+
+
+def _negotiate_format():
+    """返回紧凑表示名称，None 表示原文
+
+    查询参数 ?format=json|msgpack|raw 优先，压缩 JSON 只能这样选中；
+    否则按 Accept，只有明确列出 application/msgpack 才会选中，
+    application/json、*/* 等仍返回原文。
+    """
+    name = request.args.get("format")
+    if name is not None:
+        if name in ("", "raw"):
+            return None
+        if name == "msgpack" and name not in FORMATS:
+            raise LookupError("服务器未安装 msgpack，暂不支持 msgpack 格式")
+        if name not in FORMATS:
+            raise LookupError(f"不支持的格式: {name}")
+        return name
+    if not _FORMAT_MIMETYPES:
+        return None
+    best = request.accept_mimetypes.best_match(
+        [RAW_CONTENT_TYPE.split(";")[0], *_FORMAT_MIMETYPES], "text/plain"
+    )
+    return _FORMAT_MIMETYPES.get(best)
+
+
+def _build_view(entry, server_filter, fmt):
+    """按筛选参数和表示生成派生内容；原文表示的筛选结果保持原文件的缩进格式"""
+    config_data = entry.parsed()
+    if server_filter is not None:
+        if not isinstance(config_data, dict):
+            raise ValueError("配置内容不是 JSON 对象")
+        config_data = dict(config_data)
+        config_data["serverData"] = server_filter.apply(entry.servers())
+    if fmt is None:
+        body, content_type = serialize_config(config_data), RAW_CONTENT_TYPE
+    else:
+        content_type, encode = FORMATS[fmt]
+        started = time.perf_counter()
+        body = encode(config_data)
+        profiling.add("json_serialize", time.perf_counter() - started)
+    return CachedPayload(
+        entry.file_id,
+        entry.uuid,
+        entry.type,
+        entry.path,
+        entry.signature,
+        body,
+        content_type,
+    )
+
+
+def send_cached_payload(entry, outcome):
+    """按请求头协商缓存条目的变体并返回响应（主节点与边缘节点共用）
+
+    带筛选参数或协商到紧凑表示时，改用该内容版本上缓存的派生视图（每种只生成一次）；
+    都没有时原样返回文件内容。
+    """
+    try:
+        fmt = _negotiate_format()
+    except LookupError as e:
+        metrics.set_outcome("dalvik", "error")
+        return f"{e.args[0]}，可选 raw、{'、'.join(FORMATS)}", 406
+    try:
+        server_filter = ServerFilter.from_args(request.args)
+        if server_filter is not None:
+            key = (config_cache.selection(entry, server_filter), fmt)
+            entry = config_cache.view(
+                entry, key, lambda: _build_view(entry, server_filter, fmt), filtered=True
             )
-            content, err = read_file_content(modlist_path)
-            if content:
-                return content, 200, {"Content-Type": "application/json; charset=utf-8"}
-            else:
-                return "modlist文件读取失败: " + (err or ""), 500
+        elif fmt is not None:
+            entry = config_cache.view(entry, (None, fmt), lambda: _build_view(entry, None, fmt))
+    except ValueError as e:
+        metrics.set_outcome("dalvik", "error")
+        return f"参数错误: {e}", 400
+    profiling.mark("filter")
+
+    # 按 Accept-Encoding 选择预先压缩好的变体
+    variant = entry.select(request.accept_encodings)
+
+    # 客户端缓存仍然有效时直接返回304
+    modified = is_resource_modified(
+        request.environ, etag=variant.etag, last_modified=entry.last_modified
+    )
+    profiling.mark("negotiate")
+    if not modified:
+        metrics.set_outcome("dalvik", "not_modified")
+        return "", 304, variant.headers
 
     # User-Agent 符合且文件存在，返回真实文件内容
-    content, err = read_file_content(path)
-    if content:
-        return content, 200, {"Content-Type": "text/plain; charset=utf-8"}
-    else:
-        return f"文件读取异常: {err}", 500
+    metrics.set_outcome("dalvik", outcome)
+    return variant.body, 200, variant.headers
+
+
+@views_bp.route("/api/sync/configs", methods=["GET"])
+def sync_configs():
+    """边缘节点增量同步：返回 sync_seq 大于 since 的配置（含已删除的）及其当前内容
+
+    需要请求头 X-Sync-Token 与 .env 中的 SYNC_TOKEN 一致；未设置 SYNC_TOKEN 时接口不存在。
+    version 为本次返回到的序号，more 为真时还有剩余，边缘节点应立即继续拉取。
+    current 为主节点当前序号，epoch 为主库的同步纪元；current 小于边缘节点的 since
+    或 epoch 变化说明主库被替换或回退过，边缘节点应清空本地数据从 0 重新同步。
+    """
+    token = os.getenv("SYNC_TOKEN")
+    if not token:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get("X-Sync-Token", ""), token):
+        return "无权限访问", 403
+    since = request.args.get("since", 0, type=int)
+    limit = max(1, min(request.args.get("limit", 100, type=int), 1000))
+
+    conn = get_db_connection()
+    c = conn.cursor()
+    # 先读当前序号：之后查到的记录不会早于它，没有记录时可以直接把版本推进到这里
+    c.execute("SELECT seq, epoch FROM sync_sequence WHERE id = 1")
+    current, epoch = c.fetchone()
+    c.execute(
+        "SELECT * FROM config_files WHERE sync_seq > ? ORDER BY sync_seq LIMIT ?",
+        (since, limit + 1),
+    )
+    rows = c.fetchall()
+    conn.close()
+
+    more = len(rows) > limit
+    rows = rows[:limit]
+    configs = []
+    for row in rows:
+        content = None
+        deleted = row["delete_time"] is not None
+        if not deleted and os.path.exists(row["path"]):
+            content, _, err = read_config_text(row)
+            if content is None:
+                logger.warning("同步时读取配置失败: %s %s", row["uuid"], err)
+        configs.append(
+            {
+                "uuid": row["uuid"],
+                "type": row["type"],
+                "content_version": row["content_version"],
+                "sync_seq": row["sync_seq"],
+                "deleted": deleted,
+                "content": content,
+            }
+        )
+    version = rows[-1]["sync_seq"] if rows else current
+    response = jsonify(
+        version=version, current=current, epoch=epoch, more=more, configs=configs
+    )
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+
+# ===========================
+# 配置变化通知（长轮询 / SSE）
+# ===========================
+def _feed_since():
+    """客户端已有的内容版本：?since=N，SSE 重连时也接受 Last-Event-ID"""
+    since = request.args.get("since", type=int)
+    if since is None:
+        since = request.headers.get("Last-Event-ID", type=int)
+    return since
+
+
+def _feed_busy_headers():
+    """本进程挂起的连接已达上限：不挂起，立即回答当前状态，并告诉客户端多久后再来"""
+    return {"Retry-After": str(int(change_feed.busy_retry)), "Cache-Control": "no-store"}
+
+
+@views_bp.route("/api/config/<string:file_id>/changes", methods=["GET"])
+def public_config_changes(file_id):
+    """长轮询：内容版本与 since 不同时返回 200，等到超时仍无变化返回 204
+
+    不带 since 时立即返回当前版本，供启动器取得基线。
+    """
+    if not request.headers.get("User-Agent", "").startswith("Dalvik"):
+        abort(404)
+    since = _feed_since()
+    version = change_feed.version(file_id)
+    if version is None:
+        abort(404)
+    if since is not None and version == since:
+        if not change_feed.acquire():
+            return "", 204, _feed_busy_headers()
+        try:
+            timeout = request.args.get("timeout", change_feed.max_wait, type=float)
+            timeout = max(0.0, min(timeout, change_feed.max_wait))
+            version = change_feed.wait(file_id, since, timeout)
+        finally:
+            change_feed.release()
+        if version is None:
+            abort(404)
+    if version == since:
+        return "", 204, {"Cache-Control": "no-store"}
+    response = jsonify(uuid=file_id, content_version=version)
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+
+@views_bp.route("/api/config/<string:file_id>/events", methods=["GET"])
+def public_config_events(file_id):
+    """SSE：每次内容版本变化推送一条 version 事件，空闲时定期发送注释行保活
+
+    连接保持 stream_seconds 秒后由服务端关闭，客户端带 Last-Event-ID 重连即可续上。
+    """
+    if not request.headers.get("User-Agent", "").startswith("Dalvik"):
+        abort(404)
+    since = _feed_since()
+    if change_feed.version(file_id) is None:
+        abort(404)
+    if since is None:
+        since = -1
+    if not change_feed.acquire():
+        # 只发当前版本（有变化时）和重连间隔后关闭，EventSource 按 retry 自动重连
+        version = change_feed.version(file_id)
+        body = f"retry: {int(change_feed.busy_retry * 1000)}\n\n"
+        if version != since:
+            data = json.dumps({"uuid": file_id, "content_version": version})
+            body += f"id: {version}\nevent: version\ndata: {data}\n\n"
+        return Response(body, mimetype="text/event-stream", headers=_feed_busy_headers())
+
+    def stream():
+        last = since
+        deadline = time.monotonic() + change_feed.stream_seconds
+        yield f"retry: {int(change_feed.keepalive * 1000)}\n\n"
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            version = change_feed.wait(file_id, last, min(change_feed.keepalive, remaining))
+            if version is None:
+                # 配置已删除
+                yield "event: deleted\ndata: {}\n\n"
+                return
+            if version != last:
+                last = version
+                data = json.dumps({"uuid": file_id, "content_version": version})
+                yield f"id: {version}\nevent: version\ndata: {data}\n\n"
+            else:
+                yield ": keepalive\n\n"
+
+    response = Response(
+        stream(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"},
+    )
+    # 客户端断开或流结束时服务器关闭响应，这里归还名额（生成器没开始迭代时 finally 不会执行）
+    response.call_on_close(change_feed.release)
+    return response
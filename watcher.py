@@ -0,0 +1,292 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+import threading
+
+from cache import config_cache
+from decoys import decoy_store
+from models import get_db_connection
+from publish import record_external_change
+from storage import file_signature, read_file_content
+
+logger = logging.getLogger(__name__)
+
+# inotify 事件掩码
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+WATCH_MASK = (
+    IN_CLOSE_WRITE
+    | IN_ATTRIB
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+)
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class Inotify:
+    """通过 ctypes 调用 libc 的 inotify 接口（仅 Linux）"""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd):
+        self._rm_watch(self.fd, wd)
+
+    def read_events(self, timeout):
+        """等待最多 timeout 秒，返回 [(wd, mask, name)]"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+        events = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FileWatcher:
+    """监控所有有效配置文件以及 err_return 目录
+
+    Linux 上用 inotify 监控文件所在目录（能捕获 rename 覆盖），其他平台退回定期 stat 轮询。
+    发现变化后失效进程内缓存、重载伪装响应，并把界面之外的修改记录到 config_file_events。
+    inotify 正常工作时，配置缓存命中不再需要每次 stat 文件。
+    """
+
+    def __init__(self, poll_interval=2.0, debounce=0.5, rescan_interval=30.0):
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.rescan_interval = rescan_interval
+        self.mode = None
+        self._inotify = None
+        self._lock = threading.Lock()
+        self._files = {}  # 绝对路径 -> [(file_id, uuid)]
+        self._signatures = {}  # 轮询模式下上一次看到的签名
+        self._dir_watches = {}  # 目录 -> wd
+        self._wd_dirs = {}  # wd -> 目录
+        self._pending = {}  # 路径 -> 首次发现变化的时间
+        self._last_rescan = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+        self.events_seen = 0
+        self.external_changes = 0
+
+    def start(self):
+        if self._thread is not None:
+            self.refresh()
+            return self
+        if sys.platform.startswith("linux"):
+            try:
+                self._inotify = Inotify()
+                self.mode = "inotify"
+            except OSError as e:
+                logger.warning("inotify 不可用，改为轮询: %s", e)
+        if self._inotify is None:
+            self.mode = "polling"
+        self.refresh()
+        self._thread = threading.Thread(target=self._run, name="file-watcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        if self._inotify is not None:
+            self._inotify.close()
+        config_cache.verify_signatures = True
+
+    def refresh(self):
+        """重新加载需要监控的路径（新增/修改配置路径后调用）"""
+        if self.mode is None:
+            return
+        conn = get_db_connection()
+        c = conn.cursor()
+        c.execute("SELECT id, uuid, path FROM config_files WHERE delete_time IS NULL")
+        rows = c.fetchall()
+        conn.close()
+
+        files = {}
+        for row in rows:
+            files.setdefault(os.path.abspath(row["path"]), []).append(
+                (row["id"], row["uuid"])
+            )
+        directories = {os.path.dirname(path) for path in files}
+        directories.add(os.path.abspath(decoy_store.directory))
+
+        with self._lock:
+            self._files = files
+            for path in files:
+                if path not in self._signatures:
+                    self._signatures[path] = file_signature(path)
+            self._last_rescan = time.monotonic()
+            if self._inotify is not None:
+                self._update_dir_watches(directories)
+
+    def _update_dir_watches(self, directories):
+        all_watched = True
+        for directory in directories - set(self._dir_watches):
+            try:
+                wd = self._inotify.add_watch(directory)
+            except OSError as e:
+                logger.warning("无法监控目录 %s: %s", directory, e)
+                # 伪装目录另有后台线程兜底，只有配置目录缺失监控才需要回到 stat 校验
+                if directory != os.path.abspath(decoy_store.directory):
+                    all_watched = False
+                continue
+            self._dir_watches[directory] = wd
+            self._wd_dirs[wd] = directory
+        for directory in set(self._dir_watches) - directories:
+            wd = self._dir_watches.pop(directory)
+            self._wd_dirs.pop(wd, None)
+            self._inotify.rm_watch(wd)
+        # 所有配置目录都在监控中时，缓存命中可以信任失效通知而不再 stat
+        config_cache.verify_signatures = not all_watched
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self._inotify is not None:
+                    self._collect_inotify()
+                else:
+                    self._stop.wait(self.poll_interval)
+                    self._collect_polling()
+                self._flush_pending()
+                if time.monotonic() - self._last_rescan >= self.rescan_interval:
+                    self.refresh()
+            except Exception:
+                logger.exception("文件监控出错")
+                self._stop.wait(self.poll_interval)
+
+    def _collect_inotify(self):
+        for wd, mask, name in self._inotify.read_events(timeout=self.debounce):
+            if mask & IN_Q_OVERFLOW:
+                # 事件队列溢出，无法知道哪些文件变了，全部失效
+                logger.warning("inotify 事件队列溢出，清空配置缓存")
+                config_cache.clear()
+                decoy_store.refresh()
+                continue
+            directory = self._wd_dirs.get(wd)
+            if directory is None:
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                # 目录本身被删除或移走，下一次 refresh 重新监控
+                with self._lock:
+                    self._dir_watches.pop(directory, None)
+                    self._wd_dirs.pop(wd, None)
+                config_cache.verify_signatures = True
+                continue
+            self.events_seen += 1
+            self._mark(os.path.join(directory, name))
+
+    def _collect_polling(self):
+        with self._lock:
+            paths = list(self._files)
+        paths.extend(decoy_store.path_for(name) for name in ("qu", "modlist"))
+        for path in paths:
+            signature = file_signature(path)
+            if self._signatures.get(path) != signature:
+                self._signatures[path] = signature
+                self.events_seen += 1
+                self._mark(path)
+
+    def _mark(self, path):
+        path = os.path.abspath(path)
+        # 缓存立即失效，记录外部修改等 debounce 之后再做
+        with self._lock:
+            targets = self._files.get(path, [])
+        for file_id, _ in targets:
+            config_cache.invalidate_file(file_id)
+        self._pending.setdefault(path, time.monotonic())
+
+    def _flush_pending(self):
+        # 等待 debounce 秒再处理：发布流程先 rename 再提交事务，留出时间避免误判为外部修改
+        now = time.monotonic()
+        ready = [p for p, seen in self._pending.items() if now - seen >= self.debounce]
+        for path in ready:
+            del self._pending[path]
+            self._handle_change(path)
+
+    def _handle_change(self, path):
+        if os.path.dirname(path) == os.path.abspath(decoy_store.directory):
+            if decoy_store.refresh():
+                logger.info("伪装响应文件已重新加载: %s", path)
+            return
+
+        with self._lock:
+            targets = self._files.get(path, [])
+        if not targets:
+            return
+        signature = file_signature(path)
+        encoding = None
+        if signature is not None:
+            content, encoding, _ = read_file_content(path)
+            if content is None:
+                encoding = None
+        for file_id, _ in targets:
+            if record_external_change(file_id, path, signature, encoding):
+                self.external_changes += 1
+                logger.info("发现外部修改: %s (config_file_id=%s)", path, file_id)
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "files": len(self._files),
+            "directories": len(self._dir_watches),
+            "events_seen": self.events_seen,
+            "external_changes": self.external_changes,
+            "verify_signatures": config_cache.verify_signatures,
+        }
+
+
+# 进程级单例，create_app() 中启动
+file_watcher = FileWatcher()
@@ -0,0 +1,4 @@
+# 供 gunicorn / waitress 等 WSGI 服务器直接加载：gunicorn wsgi:app
+from app import create_app
+
+app = create_app()